@@ -18,30 +18,208 @@ Environment Variables:
 """
 
 import os
+import asyncio
+import atexit
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import cProfile
+import functools
+import hmac
+import inspect
+import json
 import logging
+import logging.handlers
+import pstats
+import queue
+import random
+import re
+import secrets
+import string
 import sys
-from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
+import threading
+import time
+import traceback
+import types
+from typing import (
+    Any, AsyncIterator, Callable, Deque, Dict, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple, Union, cast
+)
 from datetime import datetime
+from urllib.parse import quote, urlsplit
 
 import requests
+import requests.adapters
 from retry import retry
 from dotenv import load_dotenv
 import uvicorn
+import uvicorn.config
 
 load_dotenv()
 
 # Configure logging
-logging.basicConfig(
-    level=os.getenv("LOG_LEVEL", "INFO").upper(),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# LOG_ASYNC=true moves formatting and writes to a background thread through a
+# queue, LOG_FORMAT=json emits one JSON object per line, and repeated warnings
+# and errors are rate-limited per tool (or logger) and message template.
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_ASYNC = os.getenv("LOG_ASYNC", "false").lower() == "true"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_ERROR_BURST = int(os.getenv("LOG_ERROR_BURST", "10"))
+LOG_ERROR_WINDOW = float(os.getenv("LOG_ERROR_WINDOW", "60"))
+LOG_TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class RepeatedErrorFilter(logging.Filter):
+    """Let through at most LOG_ERROR_BURST identical warnings/errors per window.
+
+    Records are keyed on their `tool` extra (or logger name) and unformatted
+    message template, so the check never formats the message. A message that
+    is not a string is keyed on its str(), and a record that cannot be keyed
+    at all is let through: logging must never raise. The first record let
+    through after a suppressed burst carries the suppressed count.
+    """
+
+    def __init__(self, burst: int, window: float):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._counters: Dict[Tuple[str, str], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0 or record.levelno < logging.WARNING:
+            return True
+        try:
+            msg = record.msg if isinstance(record.msg, str) else str(record.msg)
+            key = (str(getattr(record, "tool", None) or record.name), msg)
+        except Exception:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            # [window start, records seen, records suppressed]
+            counter = self._counters.get(key)
+            if counter is None or now - counter[0] >= self.window:
+                suppressed = int(counter[2]) if counter else 0
+                if len(self._counters) > 10000:
+                    self._counters.clear()
+                self._counters[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            counter[1] += 1
+            if counter[1] <= self.burst:
+                return True
+            counter[2] += 1
+            return False
+
+
+class TextFormatter(logging.Formatter):
+    """The default text format, noting how many similar records were suppressed."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{text} ({suppressed} similar messages suppressed)" if suppressed else text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record for log aggregation."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in ("tool", "suppressed"):
+            if hasattr(record, key):
+                entry[key] = getattr(record, key)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread and drops records when full."""
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]"):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock prepare() formats the message on the calling thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def take_dropped(self) -> int:
+        """Return and reset the number of records dropped since the last call."""
+        if not self.dropped:
+            return 0
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class DropReportingQueueListener(logging.handlers.QueueListener):
+    """QueueListener that logs how many records its queue handler dropped."""
+
+    def __init__(self, queue_handler: DeferredQueueHandler, *handlers: logging.Handler,
+                 respect_handler_level: bool = False):
+        super().__init__(queue_handler.queue, *handlers, respect_handler_level=respect_handler_level)
+        self.queue_handler = queue_handler
+
+    def handle(self, record: logging.LogRecord) -> None:
+        # Runs on the listener thread once the queue drains, so the report itself is never dropped
+        dropped = self.queue_handler.take_dropped()
+        if dropped:
+            super().handle(logging.makeLogRecord({
+                "name": record.name,
+                "levelno": logging.WARNING,
+                "levelname": "WARNING",
+                "msg": "Dropped %d log records, log queue full",
+                "args": (dropped,),
+            }))
+        super().handle(record)
+
+
+def _configure_logging() -> None:
+    handler: logging.Handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter(LOG_TEXT_FORMAT))
+    error_filter = RepeatedErrorFilter(LOG_ERROR_BURST, LOG_ERROR_WINDOW)
+
+    if LOG_ASYNC:
+        log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        queue_handler = DeferredQueueHandler(log_queue)
+        listener = DropReportingQueueListener(queue_handler, handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        handler = queue_handler
+    handler.addFilter(error_filter)
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+
+_configure_logging()
 logger = logging.getLogger('test-skip-skill-1772170590_mcp')
 
 # FastMCP from official SDK
 from mcp.server.fastmcp import FastMCP, Context
+from mcp.server.fastmcp.exceptions import ToolError
+from starlette.applications import Starlette
 from starlette.requests import Request
 from starlette.responses import JSONResponse
 from starlette.middleware.cors import CORSMiddleware
+from starlette.types import Lifespan
 
 # D402 payment protocol - using Starlette middleware
 from traia_iatp.d402.starlette_middleware import D402PaymentMiddleware
@@ -60,7 +238,7 @@ API_KEY = None
 
 logger.info("="*80)
 logger.info(f"Test Skip Skill 1772170590 MCP Server (FastMCP + D402 Wrapper)")
-logger.info(f"API: https://date.nager.at")
+logger.info(f"API: {os.getenv('NAGER_BASE_URLS', 'https://date.nager.at')}")
 logger.info(f"Payment: {SERVER_ADDRESS}")
 logger.info("="*80)
 
@@ -70,537 +248,1577 @@ mcp = FastMCP("Test Skip Skill 1772170590 MCP Server", host="0.0.0.0")
 logger.info(f"✅ FastMCP server created")
 
 # ============================================================================
-# TOOL IMPLEMENTATIONS
+# READINESS SIGNALS
 # ============================================================================
-# Tool implementations will be added here by endpoint_implementer_crew
-# Each tool will use the @mcp.tool() and @require_payment_for_tool() decorators
-
+# /health only says the process is alive. /ready reports the signals below and
+# returns 503 when any of them crosses its threshold, so load balancers stop
+# routing to an instance before its callers see timeouts. Every signal is
+# sampled in the background; the /ready handler only reads cached values.
+
+READY_MAX_LOOP_LAG_MS = float(os.getenv("READY_MAX_LOOP_LAG_MS", "250"))
+READY_MAX_IN_FLIGHT = int(os.getenv("READY_MAX_IN_FLIGHT", "100"))
+READY_MAX_UPSTREAM_ERROR_RATE = float(os.getenv("READY_MAX_UPSTREAM_ERROR_RATE", "0.5"))
+READY_MAX_UPSTREAM_P95_MS = float(os.getenv("READY_MAX_UPSTREAM_P95_MS", "5000"))
+READY_UPSTREAM_WINDOW = int(os.getenv("READY_UPSTREAM_WINDOW", "50"))
+READY_UPSTREAM_MIN_SAMPLES = int(os.getenv("READY_UPSTREAM_MIN_SAMPLES", "5"))
+READY_FACILITATOR_INTERVAL = float(os.getenv("READY_FACILITATOR_INTERVAL", "15"))
+READY_FACILITATOR_TIMEOUT = float(os.getenv("READY_FACILITATOR_TIMEOUT", "3"))
+READY_REQUIRE_WARM_CACHE = os.getenv("READY_REQUIRE_WARM_CACHE", "true").lower() == "true"
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+LOOP_LAG_WINDOW = int(os.getenv("LOOP_LAG_WINDOW", "10"))
+LOOP_STALL_THRESHOLD_MS = float(os.getenv("LOOP_STALL_THRESHOLD_MS", "100"))
+COUNTRY_CACHE_TTL = float(os.getenv("COUNTRY_CACHE_TTL", "86400"))
+
+
+class EventLoopLagMonitor:
+    """Measures how late the event loop wakes up from a fixed-interval sleep.
+
+    A watchdog thread also watches the loop's heartbeat. When the loop has not
+    ticked for longer than the stall threshold, it logs the loop thread's
+    current stack, which points straight at whatever is blocking it.
+    """
 
-# D402 Payment Middleware
-# The HTTP 402 payment protocol middleware is already configured in the server initialization.
-# It's imported from traia_iatp.d402.mcp_middleware and auto-detects configuration from:
-# - PAYMENT_ADDRESS or EVM_ADDRESS: Where to receive payments
-# - EVM_NETWORK: Blockchain network (default: base-sepolia)
-# - DEFAULT_PRICE_USD: Price per request (default: $0.001)
-# - TEST_SKIP_SKILL_1772170590_API_KEY: Server's internal API key for payment mode
-#
-# All payment verification logic is handled by the traia_iatp.d402 module.
-# No custom implementation needed!
+    def __init__(self, interval: float, window: int, stall_threshold_ms: float):
+        self.interval = interval
+        self.stall_threshold_ms = stall_threshold_ms
+        self._samples: Deque[float] = collections.deque(maxlen=max(1, window))
+        self._task: Optional[asyncio.Task] = None
+        self._heartbeat = time.monotonic()
+        self._reported_heartbeat: Optional[float] = None
+        self._loop_thread_id: Optional[int] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    @property
+    def lag_ms(self) -> float:
+        """Worst lag over the recent window, so a single stall is not forgotten on the next tick."""
+        return max(self._samples, default=0.0)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self._heartbeat = time.monotonic()
+            self._samples.append(max(0.0, (loop.time() - started - self.interval) * 1000))
+
+    def _watch(self) -> None:
+        # Poll often enough to catch a stall shorter than the sampling interval
+        poll = min(self.interval, self.stall_threshold_ms / 1000) / 2
+        while not self._stopping.wait(poll):
+            heartbeat = self._heartbeat
+            stalled_ms = (time.monotonic() - heartbeat - self.interval) * 1000
+            if stalled_ms < self.stall_threshold_ms or heartbeat == self._reported_heartbeat:
+                continue
+            # Report each stall once, with the stack that is holding the loop right now
+            self._reported_heartbeat = heartbeat
+            thread_id = self._loop_thread_id
+            frame = sys._current_frames().get(thread_id) if thread_id is not None else None
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<unavailable>\n"
+            logger.warning("Event loop blocked for %.0fms; loop thread stack:\n%s", stalled_ms, stack)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._loop_thread_id = threading.get_ident()
+            self._heartbeat = time.monotonic()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        if self._watchdog is None and self.stall_threshold_ms > 0:
+            self._stopping.clear()
+            self._watchdog = threading.Thread(target=self._watch, name="loop-stall-watchdog", daemon=True)
+            self._watchdog.start()
+
+    async def stop(self) -> None:
+        if self._watchdog is not None:
+            self._stopping.set()
+            self._watchdog = None
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+
+class UpstreamStats:
+    """Rolling window of recent upstream call outcomes and latencies."""
+
+    def __init__(self, window: int):
+        self._samples: Deque[Tuple[bool, float]] = collections.deque(maxlen=max(1, window))
+        self._lock = threading.Lock()
+
+    def record(self, ok: bool, latency_s: float) -> None:
+        with self._lock:
+            self._samples.append((ok, latency_s))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = list(self._samples)
+        if not samples:
+            return {"samples": 0, "error_rate": 0.0, "p95_latency_ms": 0.0}
+        errors = sum(1 for ok, _ in samples if not ok)
+        latencies = sorted(latency for _, latency in samples)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return {
+            "samples": len(samples),
+            "error_rate": round(errors / len(samples), 3),
+            "p95_latency_ms": round(p95 * 1000, 1),
+        }
 
 
-# API Endpoint Tool Implementations
+class CountryCache:
+    """In-memory copy of /api/v3/AvailableCountries, warmed at startup."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.countries: Optional[List[Dict[str, Any]]] = None
+        self.codes: frozenset = frozenset()
+        self.loaded_at: Optional[float] = None
+
+    @property
+    def warm(self) -> bool:
+        return self.countries is not None
+
+    @property
+    def fresh(self) -> bool:
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    def refresh(self) -> None:
+        _, countries = call_nager_api("/api/v3/AvailableCountries")
+        self.countries = countries
+        self.codes = frozenset(str(c.get("countryCode", "")).upper() for c in countries)
+        self.loaded_at = time.monotonic()
+
+    async def keep_warm(self) -> None:
+        """Load the country list, retrying with backoff, then refresh it every TTL."""
+        delay = 1.0
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+                logger.info("✅ Country cache warmed (%d countries)", len(self.codes))
+                delay = 1.0
+                await asyncio.sleep(self.ttl)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Country cache warm-up failed, retrying in %.0fs: %s", delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60.0)
+
+
+class ReadinessMonitor:
+    """Collects saturation signals and decides whether this instance should take traffic."""
+
+    def __init__(self):
+        self.loop_lag = EventLoopLagMonitor(LOOP_LAG_INTERVAL, LOOP_LAG_WINDOW, LOOP_STALL_THRESHOLD_MS)
+        self.upstream = UpstreamStats(READY_UPSTREAM_WINDOW)
+        self.countries = CountryCache(COUNTRY_CACHE_TTL)
+        self.in_flight = 0
+        self.facilitator_url: Optional[str] = None
+        self.facilitator_reachable: Optional[bool] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def _probe_facilitator(self, url: str) -> None:
+        while True:
+            try:
+                response = await asyncio.to_thread(
+                    requests.get, url, timeout=READY_FACILITATOR_TIMEOUT
+                )
+                self.facilitator_reachable = response.status_code < 500
+            except requests.RequestException as e:
+                if self.facilitator_reachable is not False:
+                    logger.warning("D402 facilitator unreachable: %s", e)
+                self.facilitator_reachable = False
+            await asyncio.sleep(READY_FACILITATOR_INTERVAL)
+
+    async def start(self, facilitator_url: Optional[str]) -> None:
+        loop = asyncio.get_running_loop()
+        self.loop_lag.start()
+        self.facilitator_url = facilitator_url
+        if facilitator_url:
+            self._tasks.append(loop.create_task(self._probe_facilitator(facilitator_url)))
+        self._tasks.append(loop.create_task(self.countries.keep_warm()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._tasks.clear()
+        await self.loop_lag.stop()
+
+    def evaluate(self) -> Tuple[bool, Dict[str, Any]]:
+        """Return (ready, per-check details) from the latest cached signals."""
+        checks: Dict[str, Dict[str, Any]] = {}
+
+        lag = self.loop_lag.lag_ms
+        checks["event_loop_lag"] = {
+            "ok": lag <= READY_MAX_LOOP_LAG_MS,
+            "value_ms": round(lag, 1),
+            "threshold_ms": READY_MAX_LOOP_LAG_MS,
+        }
+        checks["in_flight_tool_calls"] = {
+            "ok": self.in_flight <= READY_MAX_IN_FLIGHT,
+            "value": self.in_flight,
+            "threshold": READY_MAX_IN_FLIGHT,
+        }
 
-@mcp.tool()
-@require_payment_for_tool(
-    price=TokenAmount(
-        amount="1000000000000000",  # 0.001 tokens
-        asset=TokenAsset(
-            address="0x3e17730bb2ca51a8D5deD7E44c003A2e95a4d822",
-            decimals=18,
-            network="sepolia",
-            eip712=EIP712Domain(
-                name="IATPWallet",
-                version="1"
-            )
-        )
-    ),
-    description="Provide a valid `ISO 3166-1 alpha-2` country code "
+        upstream = self.upstream.snapshot()
+        enough = upstream["samples"] >= READY_UPSTREAM_MIN_SAMPLES
+        checks["upstream_error_rate"] = {
+            "ok": not enough or upstream["error_rate"] <= READY_MAX_UPSTREAM_ERROR_RATE,
+            "value": upstream["error_rate"],
+            "samples": upstream["samples"],
+            "threshold": READY_MAX_UPSTREAM_ERROR_RATE,
+        }
+        checks["upstream_latency"] = {
+            "ok": not enough or upstream["p95_latency_ms"] <= READY_MAX_UPSTREAM_P95_MS,
+            "p95_ms": upstream["p95_latency_ms"],
+            "threshold_ms": READY_MAX_UPSTREAM_P95_MS,
+        }
 
-)
-async def retrieves_detailed_information_about_a_specific_country(
-    context: Context,
-    countryCode: str = "us"
-) -> Any:
-    """
-    Provide a valid `ISO 3166-1 alpha-2` country code to retrieve country metadata. The response includes commonly used and official country names, the assigned region, and if available neighboring countries based on geographical borders.
+        if self.facilitator_url:
+            # Unknown (probe not finished yet) counts as not ready.
+            checks["facilitator"] = {"ok": self.facilitator_reachable is True, "reachable": self.facilitator_reachable}
+        else:
+            checks["facilitator"] = {"ok": True, "skipped": "testing mode"}
 
-    Generated from OpenAPI endpoint: GET /api/v3/CountryInfo/{countryCode}
+        mirrors = upstream_pool.snapshot()
+        checks["upstream_mirrors"] = {
+            "ok": any(not m["ejected"] for m in mirrors),
+            "mirrors": mirrors,
+        }
 
-    Args:
-        context: MCP context (auto-injected by framework, not user-provided)
-        countryCode: The 2-letter ISO 3166-1 country code (e.g., "US", "GB"). (optional, default: "us")
+        checks["cache_warm"] = {
+            "ok": self.countries.warm or not READY_REQUIRE_WARM_CACHE,
+            "warm": self.countries.warm,
+            "fresh": self.countries.fresh,
+        }
 
-    Returns:
-        API response (dict, list, or other JSON type)
+        return all(check["ok"] for check in checks.values()), checks
 
-    Example Usage:
-        await retrieves_detailed_information_about_a_specific_country(countryCode="us")
 
-        Note: 'context' parameter is auto-injected by MCP framework
-    """
-    # Payment already verified by @require_payment_for_tool decorator
-    # No authentication required for this API - api_key not needed
+readiness = ReadinessMonitor()
 
-    try:
-        url = f"https://date.nager.at/api/v3/CountryInfo/{countryCode}"
-        params = {}
-        headers = {}
-        # No auth required for this API
-
-        response = requests.get(
-            url,
-            params=params,
-            headers=headers,
-            timeout=30
-        )
-        response.raise_for_status()
 
-        return response.json()
+# ============================================================================
+# PROFILING HOOKS
+# ============================================================================
+# POST /admin/profile (Authorization: Bearer $ADMIN_TOKEN) turns on profiling
+# for a time window, optionally restricted to the calls of one tool:
+#   - "sampling": a thread samples the event-loop thread's stack every
+#     PROFILE_SAMPLE_INTERVAL_MS and writes folded stacks (flamegraph/speedscope)
+#   - "cprofile": cProfile on the event-loop thread, written as .prof + text summary
+# Tool-scoped cProfile also records whatever other coroutines run while that
+# tool is awaiting, since they share the loop thread.
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_OUTPUT_DIR = os.getenv("PROFILE_OUTPUT_DIR", "logs/profiles")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_MODES = ("sampling", "cprofile")
+
+
+def _folded_stack(frame: Optional[types.FrameType]) -> str:
+    """Render a frame chain root-first in folded-stack format."""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class ProfilingSession:
+    """One profiling window; writes its results under PROFILE_OUTPUT_DIR when it ends."""
+
+    def __init__(self, mode: str, seconds: float, tool: Optional[str]):
+        self.mode = mode
+        self.seconds = seconds
+        self.tool = tool
+        self.started_at = datetime.now()
+        stamp = self.started_at.strftime("%Y%m%d-%H%M%S")
+        self.output_base = os.path.join(PROFILE_OUTPUT_DIR, f"{mode}-{tool or 'all'}-{stamp}")
+        self.outputs: List[str] = []
+        self.done = False
+        self._active_tool_calls = 0
+        self._profile: Optional[cProfile.Profile] = None
+        self._sampler: Optional[threading.Thread] = None
+        self._stop_sampling = threading.Event()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        # Called from the event loop, so this is the thread the sampler watches
+        loop_thread_id = threading.get_ident()
+        if self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            if self.tool is None:
+                self._profile.enable()
+        else:
+            self._sampler = threading.Thread(
+                target=self._sample, args=(loop_thread_id,), name="loop-profiler", daemon=True
+            )
+            self._sampler.start()
+        self._timer = loop.call_later(self.seconds, self.finish)
+
+    def tool_started(self, tool: str) -> None:
+        if self.tool != tool:
+            return
+        self._active_tool_calls += 1
+        if self._profile is not None and self._active_tool_calls == 1:
+            self._profile.enable()
+
+    def tool_finished(self, tool: str) -> None:
+        # Calls that began before the session started were never counted
+        if self.tool != tool or self._active_tool_calls == 0:
+            return
+        self._active_tool_calls -= 1
+        if self._profile is not None and self._active_tool_calls == 0:
+            self._profile.disable()
+
+    def _sample(self, loop_thread_id: int) -> None:
+        counts: collections.Counter = collections.Counter()
+        interval = PROFILE_SAMPLE_INTERVAL_MS / 1000
+        while not self._stop_sampling.wait(interval):
+            if self.tool is not None and self._active_tool_calls == 0:
+                continue
+            frame = sys._current_frames().get(loop_thread_id)
+            if frame is not None:
+                counts[_folded_stack(frame)] += 1
+        path = f"{self.output_base}.folded"
+        os.makedirs(PROFILE_OUTPUT_DIR, exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+        self.outputs.append(path)
+        logger.info("📈 Wrote %d stack samples to %s", sum(counts.values()), path)
+
+    def _write_cprofile(self, profile: cProfile.Profile) -> None:
+        # A tool-scoped window in which the tool never ran has nothing to write;
+        # pstats.Stats() refuses an empty profile
+        if not profile.getstats():
+            logger.info("📈 cProfile window ended with no calls profiled (tool=%s)", self.tool or "*")
+            return
+        os.makedirs(PROFILE_OUTPUT_DIR, exist_ok=True)
+        profile.dump_stats(f"{self.output_base}.prof")
+        with open(f"{self.output_base}.txt", "w") as f:
+            pstats.Stats(profile, stream=f).sort_stats("cumulative").print_stats(50)
+        self.outputs.extend([f"{self.output_base}.prof", f"{self.output_base}.txt"])
+        logger.info("📈 Wrote cProfile results to %s.prof", self.output_base)
+
+    def finish(self) -> None:
+        """End the window; must run on the event-loop thread."""
+        if self.done:
+            return
+        self.done = True
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._profile is not None:
+            self._profile.disable()
+            written = asyncio.get_running_loop().run_in_executor(None, self._write_cprofile, self._profile)
+            written.add_done_callback(self._log_write_failure)
+        if self._sampler is not None:
+            self._stop_sampling.set()
+
+    def _log_write_failure(self, future: "asyncio.Future[None]") -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Writing cProfile results to %s failed", self.output_base, exc_info=future.exception())
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "seconds": self.seconds,
+            "tool": self.tool,
+            "started_at": self.started_at.isoformat(),
+            "done": self.done,
+            # Files are only listed once written; a window with nothing profiled has none
+            "outputs": self.outputs if self.done else [f"{self.output_base}.*"],
+        }
 
-    except Exception as e:
-        logger.error(f"Error in retrieves_detailed_information_about_a_specific_country: {e}")
-        return {"error": str(e), "endpoint": "/api/v3/CountryInfo/{countryCode}"}
 
+class Profiler:
+    """Holds the current profiling session, at most one at a time."""
 
-@mcp.tool()
-@require_payment_for_tool(
-    price=TokenAmount(
-        amount="1000000000000000",  # 0.001 tokens
-        asset=TokenAsset(
-            address="0x3e17730bb2ca51a8D5deD7E44c003A2e95a4d822",
-            decimals=18,
-            network="sepolia",
-            eip712=EIP712Domain(
-                name="IATPWallet",
-                version="1"
-            )
-        )
-    ),
-    description="This endpoint returns all countries for which publ"
+    def __init__(self):
+        self.session: Optional[ProfilingSession] = None
 
-)
-async def retrieve_the_complete_list_of_all_countries_supported_by_the_nagerdate_api(
-    context: Context
-) -> Any:
-    """
-    This endpoint returns all countries for which public-holiday data is available. Each entry includes the country's name and ISO code.
+    def start(self, mode: str, seconds: float, tool: Optional[str]) -> ProfilingSession:
+        session = ProfilingSession(mode, seconds, tool)
+        session.start()
+        self.session = session
+        logger.info("📈 Profiling started: mode=%s seconds=%.0f tool=%s", mode, seconds, tool or "*")
+        return session
 
-    Generated from OpenAPI endpoint: GET /api/v3/AvailableCountries
+    def stop(self) -> None:
+        session = self.session
+        if session is not None and not session.done:
+            session.finish()
 
-    Args:
-        context: MCP context (auto-injected by framework, not user-provided)
+    def tool_started(self, tool: str) -> None:
+        session = self.session
+        if session is not None and not session.done:
+            session.tool_started(tool)
 
+    def tool_finished(self, tool: str) -> None:
+        session = self.session
+        if session is not None:
+            session.tool_finished(tool)
 
-    Returns:
-        API response (dict, list, or other JSON type)
 
-    Example Usage:
-        await retrieve_the_complete_list_of_all_countries_supported_by_the_nagerdate_api()
+profiler = Profiler()
 
-        Note: 'context' parameter is auto-injected by MCP framework
-    """
-    # Payment already verified by @require_payment_for_tool decorator
-    # No authentication required for this API - api_key not needed
 
-    try:
-        url = f"https://date.nager.at/api/v3/AvailableCountries"
-        params = {}
-        headers = {}
-        # No auth required for this API
-
-        response = requests.get(
-            url,
-            params=params,
-            headers=headers,
-            timeout=30
-        )
-        response.raise_for_status()
+def _admin_authorized(request: Request) -> bool:
+    if not ADMIN_TOKEN:
+        return False
+    supplied = request.headers.get("authorization", "")
+    return hmac.compare_digest(supplied.encode(), f"Bearer {ADMIN_TOKEN}".encode())
 
-        return response.json()
 
-    except Exception as e:
-        logger.error(f"Error in retrieve_the_complete_list_of_all_countries_supported_by_the_nagerdate_api: {e}")
-        return {"error": str(e), "endpoint": "/api/v3/AvailableCountries"}
+# ============================================================================
+# REQUEST TRACING
+# ============================================================================
+# Per-request spans: the HTTP request, the D402 and CORS middleware stages,
+# FastMCP dispatch, the tool body and each upstream call. W3C traceparent is
+# read from incoming requests and sent to the upstream. Sampled spans go to a
+# background thread that writes JSON lines (TRACE_EXPORTER=file) or posts
+# OTLP/HTTP JSON to a local collector (TRACE_EXPORTER=otlp).
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "logs/traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "2"))
+TRACE_SKIP_PATHS = {"/health", "/ready"}
+
+SPAN_KIND_INTERNAL, SPAN_KIND_SERVER, SPAN_KIND_CLIENT = 1, 2, 3
+
+
+class Span:
+    """A timed operation within a trace."""
+
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "sampled",
+                 "attributes", "start_ns", "end_ns", "error")
+
+    def __init__(self, name: str, kind: int, trace_id: str, parent_id: Optional[str],
+                 sampled: bool, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": datetime.fromtimestamp(self.start_ns / 1e9).isoformat(),
+            "duration_ms": round(((self.end_ns or self.start_ns) - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
 
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+# version-trace_id-parent_id-flags; later versions may append more fields
+_TRACEPARENT_RE = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?$", re.IGNORECASE)
+
+
+def _parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """Return (trace_id, parent_span_id, sampled) from a W3C traceparent header."""
+    match = _TRACEPARENT_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    trace_id, parent_id, flags = match.group(1).lower(), match.group(2).lower(), int(match.group(3), 16)
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id, bool(flags & 1)
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """Creates spans and ships sampled ones to the configured exporter off the event loop."""
+
+    def __init__(self, exporter: str):
+        self.exporter = exporter
+        self.enabled = exporter in ("file", "otlp")
+        if exporter not in ("none", "file", "otlp"):
+            logger.warning("Unknown TRACE_EXPORTER=%r, tracing disabled", exporter)
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._dropped = 0
+
+    def current(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def start_span(self, name: str, kind: int = SPAN_KIND_INTERNAL, parent: Optional[Span] = None,
+                   traceparent: Optional[str] = None, attributes: Optional[Dict[str, Any]] = None) -> Span:
+        """Start a child of `parent`, or a root span continuing `traceparent` if given."""
+        if parent is not None:
+            return Span(name, kind, parent.trace_id, parent.span_id, parent.sampled, attributes)
+        remote = _parse_traceparent(traceparent)
+        if remote is not None:
+            trace_id, parent_id, sampled = remote
+            return Span(name, kind, trace_id, parent_id, sampled, attributes)
+        return Span(name, kind, secrets.token_hex(16), None, random.random() < TRACE_SAMPLE_RATE, attributes)
+
+    def end_span(self, span: Span, error: Optional[BaseException] = None) -> None:
+        span.end_ns = time.time_ns()
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        if span.sampled:
+            try:
+                self._queue.put_nowait(span)
+            except queue.Full:
+                self._dropped += 1
+
+    @contextlib.contextmanager
+    def span(self, name: str, kind: int = SPAN_KIND_INTERNAL, parent: Optional[Span] = None,
+             attributes: Optional[Dict[str, Any]] = None):
+        """Run a block inside a span that becomes the current span; yields None when tracing is off."""
+        if not self.enabled:
+            yield None
+            return
+        span = self.start_span(name, kind, parent or _current_span.get(), attributes=attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, e)
+            raise
+        else:
+            self.end_span(span)
+        finally:
+            _current_span.reset(token)
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        span = _current_span.get()
+        if span is not None:
+            span.attributes[key] = value
+
+    def _drain(self, limit: int = 512) -> List[Span]:
+        spans = []
+        while len(spans) < limit:
+            try:
+                spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return spans
+
+    def _export(self, spans: List[Span]) -> None:
+        if self.exporter == "file":
+            os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+            with open(TRACE_FILE, "a") as f:
+                for span in spans:
+                    f.write(json.dumps(span.to_dict(), default=str) + "\n")
+        else:
+            payload = {"resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", "test-skip-skill-1772170590-mcp-server")]},
+                "scopeSpans": [{"scope": {"name": "server.py"}, "spans": [s.to_otlp() for s in spans]}],
+            }]}
+            requests.post(TRACE_OTLP_ENDPOINT, json=payload, timeout=5).raise_for_status()
+
+    def _run(self) -> None:
+        while True:
+            stopping = self._stopping.wait(TRACE_FLUSH_INTERVAL)
+            while True:
+                spans = self._drain()
+                if not spans:
+                    break
+                try:
+                    self._export(spans)
+                except Exception as e:
+                    logger.warning("Dropped %d spans, export failed: %s", len(spans), e)
+            if self._dropped:
+                logger.warning("Dropped %d spans, trace queue full", self._dropped)
+                self._dropped = 0
+            if stopping:
+                return
+
+    def start(self) -> None:
+        if self.enabled and self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join(timeout=10)
+            self._thread = None
+
+
+tracer = Tracer(TRACE_EXPORTER)
+
+
+class TracingMiddleware:
+    """ASGI middleware that opens a span around everything inside it.
+
+    Without `stage` it starts the request's root span (continuing an incoming
+    traceparent) and returns the trace id in `x-trace-id`. With `stage` it adds a
+    child span named after the middleware stage it wraps. The innermost span is
+    also stored in scope["state"] so tools, which FastMCP runs outside the HTTP
+    request's task, can still attach to the trace.
+    """
 
-@mcp.tool()
-@require_payment_for_tool(
-    price=TokenAmount(
-        amount="1000000000000000",  # 0.001 tokens
-        asset=TokenAsset(
-            address="0x3e17730bb2ca51a8D5deD7E44c003A2e95a4d822",
-            decimals=18,
-            network="sepolia",
-            eip712=EIP712Domain(
-                name="IATPWallet",
-                version="1"
+    def __init__(self, app, stage: Optional[str] = None):
+        self.app = app
+        self.stage = stage
+
+    async def __call__(self, scope, receive, send):
+        if not tracer.enabled or scope["type"] != "http" or scope["path"] in TRACE_SKIP_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        if self.stage is None:
+            headers = dict(scope.get("headers") or [])
+            traceparent = headers.get(b"traceparent", b"").decode("latin-1") or None
+            span = tracer.start_span(
+                f"{scope['method']} {scope['path']}", SPAN_KIND_SERVER, traceparent=traceparent,
+                attributes={"http.method": scope["method"], "http.target": scope["path"]},
             )
-        )
-    ),
-    description="A long weekend is calculated based on public holid"
-
-)
-async def retrieve_all_long_weekends_for_a_given_country_and_year(
-    context: Context,
-    year: int = 2026,
-    countryCode: str = "us",
-    availableBridgeDays: int = 1,
-    subdivisionCode: Optional[str] = None
-) -> Any:
-    """
-    A long weekend is calculated based on public holidays that create an extended break of at least three consecutive days. Optional bridge days-weekdays between a holiday and a weekend-can be included to identify potential extended leave opportunities.
+        else:
+            parent = _current_span.get()
+            if parent is None:
+                await self.app(scope, receive, send)
+                return
+            span = tracer.start_span(self.stage, parent=parent)
+        scope.setdefault("state", {})["trace_span"] = span
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                span.attributes["http.status_code"] = message["status"]
+                if self.stage is None:
+                    message = {**message, "headers": [*message.get("headers", []),
+                                                      (b"x-trace-id", span.trace_id.encode())]}
+            await send(message)
+
+        token = _current_span.set(span)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            tracer.end_span(span, e)
+            raise
+        else:
+            tracer.end_span(span)
+        finally:
+            _current_span.reset(token)
 
-    Generated from OpenAPI endpoint: GET /api/v3/LongWeekend/{year}/{countryCode}
 
-    Args:
-        context: MCP context (auto-injected by framework, not user-provided)
-        year: The target year for which long-weekend data should be calculated. (optional, default: 2026)
-        countryCode: A valid `ISO 3166-1 alpha-2` country code determining the region of interest. (optional, default: "us")
-        availableBridgeDays: The maximum number of bridge days to include when determining long-weekend opportunities. (optional, default: 1)
-        subdivisionCode: Narrow the calculation to a specific federal state, province, or subdivision (where supported). (optional)
+def _request_of(context: Any) -> Optional[Request]:
+    """The HTTP request behind a tool call, or None outside HTTP."""
+    try:
+        return context.request_context.request
+    except (AttributeError, LookupError, ValueError):
+        return None
 
-    Returns:
-        API response (dict, list, or other JSON type)
 
-    Example Usage:
-        await retrieve_all_long_weekends_for_a_given_country_and_year(year=2026, countryCode="us")
+def _request_state(context: Any) -> Dict[str, Any]:
+    """scope["state"] of the HTTP request behind a tool call, or {} outside HTTP."""
+    scope = getattr(_request_of(context), "scope", None)
+    return scope.get("state", {}) if scope else {}
 
-        Note: 'context' parameter is auto-injected by MCP framework
-    """
-    # Payment already verified by @require_payment_for_tool decorator
-    # No authentication required for this API - api_key not needed
 
-    try:
-        url = f"https://date.nager.at/api/v3/LongWeekend/{year}/{countryCode}"
-        params = {
-            "availableBridgeDays": availableBridgeDays,
-            "subdivisionCode": subdivisionCode
+# ============================================================================
+# TOOL ERRORS
+# ============================================================================
+# Failed tool calls return ToolCallError.to_dict(): the original "error" and
+# "endpoint" keys plus an "error_type" and a "retryable" flag, so clients can
+# tell bad input and deterministic upstream 4xx (do not retry) from upstream
+# 5xx, rate limits, timeouts and outages (retry later). Deterministic 4xx
+# results are negative-cached for NEGATIVE_CACHE_TTLS seconds per status.
+
+NEGATIVE_CACHE_TTLS: Dict[int, float] = {
+    int(status): float(ttl)
+    for status, ttl in (
+        item.split(":") for item in os.getenv("NEGATIVE_CACHE_TTLS", "400:60,404:300").split(",") if item.strip()
+    )
+}
+
+
+class ToolCallError(Exception):
+    """A failed tool call, classified so clients and retry logic can react."""
+
+    VALIDATION = "validation_error"
+    UPSTREAM_CLIENT = "upstream_client_error"
+    UPSTREAM_RATE_LIMITED = "upstream_rate_limited"
+    UPSTREAM_SERVER = "upstream_server_error"
+    UPSTREAM_TIMEOUT = "upstream_timeout"
+    UPSTREAM_UNAVAILABLE = "upstream_unavailable"
+    UPSTREAM_INVALID_RESPONSE = "upstream_invalid_response"
+    DEADLINE_EXCEEDED = "deadline_exceeded"
+    CANCELLED = "cancelled"
+    INTERNAL = "internal_error"
+
+    RETRYABLE = frozenset({
+        UPSTREAM_RATE_LIMITED, UPSTREAM_SERVER, UPSTREAM_TIMEOUT, UPSTREAM_UNAVAILABLE, DEADLINE_EXCEEDED
+    })
+
+    def __init__(self, kind: str, message: str, status: Optional[int] = None, field: Optional[str] = None):
+        super().__init__(message)
+        self.kind = kind
+        self.message = message
+        self.status = status
+        self.field = field
+
+    @property
+    def retryable(self) -> bool:
+        return self.kind in self.RETRYABLE
+
+    def to_dict(self, endpoint: str) -> Dict[str, Any]:
+        result: Dict[str, Any] = {
+            "error": str(self),
+            "error_type": self.kind,
+            "retryable": self.retryable,
+            "endpoint": endpoint,
         }
-        params = {k: v for k, v in params.items() if v is not None}
-        headers = {}
-        # No auth required for this API
-
-        response = requests.get(
-            url,
-            params=params,
-            headers=headers,
-            timeout=30
-        )
-        response.raise_for_status()
+        if self.status is not None:
+            result["status"] = self.status
+        if self.field is not None:
+            result["field"] = self.field
+        return result
+
+    def to_tool_error(self, endpoint: str) -> ToolError:
+        """The FastMCP error to raise so the client gets an isError result carrying to_dict()."""
+        return ToolError(json.dumps(self.to_dict(endpoint)))
+
+    @classmethod
+    def from_exception(cls, e: BaseException) -> "ToolCallError":
+        """Classify a requests exception (or anything else) raised by an upstream call."""
+        if isinstance(e, ToolCallError):
+            return e
+        if isinstance(e, requests.HTTPError) and e.response is not None:
+            status = e.response.status_code
+            if status == 429:
+                kind = cls.UPSTREAM_RATE_LIMITED
+            elif status >= 500:
+                kind = cls.UPSTREAM_SERVER
+            else:
+                kind = cls.UPSTREAM_CLIENT
+            return cls(kind, f"upstream returned HTTP {status}", status=status)
+        # requests' own messages name the mirror URL; clients get a generic one,
+        # the original stays in logs and on the upstream span
+        if isinstance(e, requests.Timeout):
+            return cls(cls.UPSTREAM_TIMEOUT, "upstream request timed out")
+        if isinstance(e, requests.ConnectionError):
+            return cls(cls.UPSTREAM_UNAVAILABLE, "upstream unreachable")
+        if isinstance(e, ValueError):
+            # requests.JSONDecodeError and friends
+            return cls(cls.UPSTREAM_INVALID_RESPONSE, "upstream returned an invalid response")
+        return cls(cls.INTERNAL, str(e))
 
-        return response.json()
-
-    except Exception as e:
-        logger.error(f"Error in retrieve_all_long_weekends_for_a_given_country_and_year: {e}")
-        return {"error": str(e), "endpoint": "/api/v3/LongWeekend/{year}/{countryCode}"}
 
+# ============================================================================
+# INPUT VALIDATION
+# ============================================================================
+# Tool arguments are canonicalized (upper-cased codes, ints) and range-checked
+# before any network I/O, so "us" and "US" share a cache entry and bad input
+# never costs an upstream round trip. PrePaymentValidationMiddleware runs the
+# same checks on tools/call requests before D402PaymentMiddleware, so callers
+# are not charged for calls that could never succeed.
 
-@mcp.tool()
-@require_payment_for_tool(
-    price=TokenAmount(
-        amount="1000000000000000",  # 0.001 tokens
-        asset=TokenAsset(
-            address="0x3e17730bb2ca51a8D5deD7E44c003A2e95a4d822",
-            decimals=18,
-            network="sepolia",
-            eip712=EIP712Domain(
-                name="IATPWallet",
-                version="1"
-            )
-        )
-    ),
-    description="This endpoint returns all officially recognized pu"
+VALIDATION_MIN_YEAR = int(os.getenv("VALIDATION_MIN_YEAR", "1900"))
+VALIDATION_MAX_YEAR = int(os.getenv("VALIDATION_MAX_YEAR", "2100"))
+VALIDATION_MAX_BODY_BYTES = 64 * 1024
 
-)
-async def retrieve_the_list_of_all_public_holidays_for_the_specified_year_and_country(
-    context: Context,
-    year: int = 2026,
-    countryCode: str = "us"
-) -> Any:
-    """
-    This endpoint returns all officially recognized public holidays for the given country and year. Each holiday entry includes the local and English holiday names, information about whether the holiday applies nationally or only in specific subdivisions, and the associated holiday type classifications.
+_COUNTRY_CODE_RE = re.compile(r"[A-Z]{2}")
+_SUBDIVISION_CODE_RE = re.compile(r"[A-Z]{2}-[A-Z0-9]{1,3}")
 
-    Generated from OpenAPI endpoint: GET /api/v3/PublicHolidays/{year}/{countryCode}
 
-    Args:
-        context: MCP context (auto-injected by framework, not user-provided)
-        year: The target year for which public holidays should be retrieved. (optional, default: 2026)
-        countryCode: A valid `ISO 3166-1 alpha-2` country code. (optional, default: "us")
+class ToolInputError(ToolCallError):
+    """A tool argument rejected locally, before any upstream call."""
 
-    Returns:
-        API response (dict, list, or other JSON type)
+    def __init__(self, field: str, message: str):
+        super().__init__(ToolCallError.VALIDATION, message, field=field)
 
-    Example Usage:
-        await retrieve_the_list_of_all_public_holidays_for_the_specified_year_and_country(year=2026, countryCode="us")
+    def __str__(self) -> str:
+        return f"{self.field}: {self.message}"
 
-        Note: 'context' parameter is auto-injected by MCP framework
-    """
-    # Payment already verified by @require_payment_for_tool decorator
-    # No authentication required for this API - api_key not needed
 
+def _as_int(field: str, value: Any) -> int:
+    # int() would truncate 2026.7, which FastMCP's own validation rejects after payment
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ToolInputError(field, f"expected an integer, got {value!r}")
     try:
-        url = f"https://date.nager.at/api/v3/PublicHolidays/{year}/{countryCode}"
-        params = {}
-        headers = {}
-        # No auth required for this API
-
-        response = requests.get(
-            url,
-            params=params,
-            headers=headers,
-            timeout=30
-        )
-        response.raise_for_status()
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ToolInputError(field, f"expected an integer, got {value!r}") from None
 
-        return response.json()
 
-    except Exception as e:
-        logger.error(f"Error in retrieve_the_list_of_all_public_holidays_for_the_specified_year_and_country: {e}")
-        return {"error": str(e), "endpoint": "/api/v3/PublicHolidays/{year}/{countryCode}"}
+def validate_country_code(value: Any) -> str:
+    code = str(value).strip().upper()
+    if not _COUNTRY_CODE_RE.fullmatch(code):
+        raise ToolInputError("countryCode", f"expected an ISO 3166-1 alpha-2 code, got {value!r}")
+    # Until the country cache is warm only the format can be checked
+    if readiness.countries.codes and code not in readiness.countries.codes:
+        raise ToolInputError("countryCode", f"{code} is not a supported country")
+    return code
 
 
-@mcp.tool()
-@require_payment_for_tool(
-    price=TokenAmount(
-        amount="1000000000000000",  # 0.001 tokens
-        asset=TokenAsset(
-            address="0x3e17730bb2ca51a8D5deD7E44c003A2e95a4d822",
-            decimals=18,
-            network="sepolia",
-            eip712=EIP712Domain(
-                name="IATPWallet",
-                version="1"
-            )
-        )
-    ),
-    description="By default, the calculation is based on the curren"
+def validate_subdivision_code(value: Any) -> Optional[str]:
+    if value is None or str(value).strip() == "":
+        return None
+    code = str(value).strip().upper()
+    if not _SUBDIVISION_CODE_RE.fullmatch(code):
+        raise ToolInputError("subdivisionCode", f"expected an ISO 3166-2 code such as US-CA, got {value!r}")
+    return code
 
-)
-async def determines_whether_today_is_a_public_holiday_in_the_specified_country_optionally_adjusted_by_a_utc_offset(
-    context: Context,
-    countryCode: str = "us",
-    countyCode: Optional[str] = None,
-    offset: int = 0
-) -> Any:
-    """
-    By default, the calculation is based on the current UTC date. You may optionally provide a timezone offset to evaluate the holiday status relative to a different local timezone. This endpoint is optimized for simple command-line or automation workflows where only the HTTP status code is required ``` STATUSCODE=$(curl --silent --output /dev/stderr --write-out "%{http_code}" https://date.nager.at/Api/v3/IsTodayPublicHoliday/AT) if [ $STATUSCODE -ne 200 ]; then # handle error fi ```
 
-    Generated from OpenAPI endpoint: GET /api/v3/IsTodayPublicHoliday/{countryCode}
+def validate_year(value: Any) -> int:
+    result = _as_int("year", value)
+    if not VALIDATION_MIN_YEAR <= result <= VALIDATION_MAX_YEAR:
+        raise ToolInputError("year", f"must be between {VALIDATION_MIN_YEAR} and {VALIDATION_MAX_YEAR}")
+    return result
 
-    Args:
-        context: MCP context (auto-injected by framework, not user-provided)
-        countryCode: A valid `ISO 3166-1 alpha-2` country code. (optional, default: "us")
-        countyCode: Optional. The subdivision code (e.g., state, province) to narrow the check. (optional)
-        offset: Optional. UTC timezone offset in hours (range: -12 to +12). (optional, default: 0)
 
-    Returns:
-        API response (dict, list, or other JSON type)
+def validate_utc_offset(value: Any) -> int:
+    result = _as_int("offset", value)
+    if not -12 <= result <= 12:
+        raise ToolInputError("offset", "must be between -12 and +12 hours")
+    return result
 
-    Example Usage:
-        await determines_whether_today_is_a_public_holiday_in_the_specified_country_optionally_adjusted_by_a_utc_offset(countryCode="us")
 
-        Note: 'context' parameter is auto-injected by MCP framework
-    """
-    # Payment already verified by @require_payment_for_tool decorator
-    # No authentication required for this API - api_key not needed
+def validate_bridge_days(value: Any) -> int:
+    result = _as_int("availableBridgeDays", value)
+    if result < 0:
+        raise ToolInputError("availableBridgeDays", "must not be negative")
+    return result
 
-    try:
-        url = f"https://date.nager.at/api/v3/IsTodayPublicHoliday/{countryCode}"
-        params = {
-            "countyCode": countyCode,
-            "offset": offset
-        }
-        params = {k: v for k, v in params.items() if v is not None}
-        headers = {}
-        # No auth required for this API
-
-        response = requests.get(
-            url,
-            params=params,
-            headers=headers,
-            timeout=30
-        )
-        response.raise_for_status()
 
-        return response.json()
+def subdivision_in_country(field: str) -> Callable[[Dict[str, Any]], None]:
+    """Cross-field check: a subdivision code must belong to the requested country."""
+    def check(arguments: Dict[str, Any]) -> None:
+        code = arguments.get(field)
+        if code and not code.startswith(f"{arguments['countryCode']}-"):
+            raise ToolInputError(field, f"{code} is not a subdivision of {arguments['countryCode']}")
+    return check
 
-    except Exception as e:
-        logger.error(f"Error in determines_whether_today_is_a_public_holiday_in_the_specified_country_optionally_adjusted_by_a_utc_offset: {e}")
-        return {"error": str(e), "endpoint": "/api/v3/IsTodayPublicHoliday/{countryCode}"}
 
+class PrePaymentValidationMiddleware:
+    """ASGI middleware that rejects invalid tools/call arguments ahead of payment.
 
-@mcp.tool()
-@require_payment_for_tool(
-    price=TokenAmount(
-        amount="1000000000000000",  # 0.001 tokens
-        asset=TokenAsset(
-            address="0x3e17730bb2ca51a8D5deD7E44c003A2e95a4d822",
-            decimals=18,
-            network="sepolia",
-            eip712=EIP712Domain(
-                name="IATPWallet",
-                version="1"
-            )
-        )
-    ),
-    description="The list includes only future holidays relative to"
-
-)
-async def retrieve_all_upcoming_public_holidays_occurring_within_the_next_365_days_for_a_given_country(
-    context: Context,
-    countryCode: str = "us"
-) -> Any:
+    Only small, single JSON-RPC POSTs to /mcp are inspected; the buffered body
+    is replayed unchanged to the rest of the stack. Rejections are returned as
+    the same isError tool result FastMCP builds when execute_endpoint() raises
+    the ToolError for those arguments after payment.
     """
-    The list includes only future holidays relative to the current date and is useful for forecasting, event planning, and applications that provide forward-looking holiday insights.
 
-    Generated from OpenAPI endpoint: GET /api/v3/NextPublicHolidays/{countryCode}
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith("/mcp"):
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        try:
+            length = int(headers.get(b"content-length", b""))
+        except ValueError:
+            length = -1
+        if not 0 < length <= VALIDATION_MAX_BODY_BYTES:
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                await self.app(scope, _replay([message], receive), send)
+                return
+            chunks.append(message)
+            if not message.get("more_body"):
+                break
+
+        rejection = self._check(b"".join(m.get("body", b"") for m in chunks))
+        if rejection is None:
+            await self.app(scope, _replay(chunks, receive), send)
+            return
+        await JSONResponse(content=rejection)(scope, receive, send)
+
+    @staticmethod
+    def _check(body: bytes) -> Optional[Dict[str, Any]]:
+        try:
+            request = json.loads(body)
+        except ValueError:
+            return None
+        if not isinstance(request, dict) or request.get("method") != "tools/call":
+            return None
+        params = request.get("params")
+        if not isinstance(params, dict) or not isinstance(params.get("name"), str):
+            return None
+        if params["name"] not in ENDPOINTS_BY_NAME:
+            return None
+        endpoint = ENDPOINTS_BY_NAME[params["name"]]
+        arguments = params.get("arguments") or {}
+        if not isinstance(arguments, dict):
+            return None
+        try:
+            endpoint.canonicalize(arguments)
+        except ToolInputError as e:
+            logger.info("Rejected %s before payment: %s", endpoint.name, e, extra={"tool": endpoint.name})
+            # FastMCP's wording for a tool that raised, so both paths read the same
+            text = f"Error executing tool {endpoint.name}: {json.dumps(e.to_dict(endpoint.path))}"
+            return {
+                "jsonrpc": "2.0",
+                "id": request.get("id"),
+                "result": {"content": [{"type": "text", "text": text}], "isError": True},
+            }
+        return None
+
 
-    Args:
-        context: MCP context (auto-injected by framework, not user-provided)
-        countryCode: A valid `ISO 3166-1 alpha-2` country code. (optional, default: "us")
+def _replay(messages: List[Dict[str, Any]], receive):
+    """An ASGI receive callable that yields `messages` first, then defers to `receive`."""
+    pending = list(messages)
 
-    Returns:
-        API response (dict, list, or other JSON type)
+    async def replay():
+        if pending:
+            return pending.pop(0)
+        return await receive()
+    return replay
 
-    Example Usage:
-        await retrieve_all_upcoming_public_holidays_occurring_within_the_next_365_days_for_a_given_country(countryCode="us")
 
-        Note: 'context' parameter is auto-injected by MCP framework
+# ============================================================================
+# TOOL EXECUTION PIPELINE
+# ============================================================================
+# Every tool is a row in ENDPOINTS (below) and runs through execute_endpoint():
+# in-flight tracking, profiling and tracing, the response cache, and a pooled
+# upstream call made on a worker thread so it never blocks the event loop.
+
+NAGER_BASE_URL = "https://date.nager.at"
+# Comma-separated mirrors, e.g. a self-hosted Nager.Date instance plus the public API
+NAGER_BASE_URLS = [
+    url.strip().rstrip("/") for url in os.getenv("NAGER_BASE_URLS", NAGER_BASE_URL).split(",") if url.strip()
+] or [NAGER_BASE_URL]
+# Kept well under TOOL_DEFAULT_DEADLINE so a hung mirror leaves time to fail over
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "3"))
+UPSTREAM_MIN_ATTEMPT_SECONDS = float(os.getenv("UPSTREAM_MIN_ATTEMPT_SECONDS", "0.25"))
+TOOL_DEFAULT_DEADLINE = float(os.getenv("TOOL_DEFAULT_DEADLINE", "30"))
+TOOL_MAX_DEADLINE = float(os.getenv("TOOL_MAX_DEADLINE", "60"))
+UPSTREAM_EWMA_ALPHA = float(os.getenv("UPSTREAM_EWMA_ALPHA", "0.3"))
+UPSTREAM_EJECT_AFTER = int(os.getenv("UPSTREAM_EJECT_AFTER", "3"))
+UPSTREAM_EJECT_SECONDS = float(os.getenv("UPSTREAM_EJECT_SECONDS", "30"))
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "32"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2048"))
+
+
+class Param(NamedTuple):
+    """A tool argument, where it goes in the upstream request, and how it is canonicalized."""
+    name: str
+    annotation: Any
+    default: Any
+    location: str  # "path" or "query"
+    description: str
+    validator: Optional[Callable[[Any], Any]] = None
+
+
+class Endpoint:
+    """One Nager.Date GET endpoint exposed as a paid MCP tool.
+
+    The path template is parsed once here, so calls only join precomputed
+    segments. `checks` run after each Param's validator for cross-field rules,
+    `cache_ttl` enables the response cache for this endpoint, `local_source`
+    can answer without going upstream (returns None to fall through), and
+    `status_results` maps body-less status codes to results.
     """
-    # Payment already verified by @require_payment_for_tool decorator
-    # No authentication required for this API - api_key not needed
 
-    try:
-        url = f"https://date.nager.at/api/v3/NextPublicHolidays/{countryCode}"
-        params = {}
-        headers = {}
-        # No auth required for this API
-
-        response = requests.get(
-            url,
-            params=params,
-            headers=headers,
-            timeout=30
+    def __init__(self, name: str, path: str, description: str, params: Sequence[Param] = (),
+                 checks: Sequence[Callable[[Dict[str, Any]], None]] = (),
+                 cache_ttl: float = 0, local_source: Optional[Callable[[], Any]] = None,
+                 status_results: Optional[Dict[int, Any]] = None):
+        self.name = name
+        self.path = path
+        self.description = description
+        self.params = tuple(params)
+        self.checks = tuple(checks)
+        self.query_params = tuple(p.name for p in self.params if p.location == "query")
+        self.cache_ttl = cache_ttl
+        self.local_source = local_source
+        self.status_results = status_results or {}
+        self._segments = tuple(
+            (literal, field) for literal, field, _, _ in string.Formatter().parse(path)
+        )
+        self.signature = inspect.Signature(
+            [inspect.Parameter("context", inspect.Parameter.POSITIONAL_OR_KEYWORD, annotation=Context)]
+            + [inspect.Parameter(p.name, inspect.Parameter.POSITIONAL_OR_KEYWORD,
+                                 default=p.default, annotation=p.annotation) for p in self.params],
+            return_annotation=Any,
+        )
+        self.docstring = self._render_docstring()
+
+    def canonicalize(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Fill defaults and normalize every argument; raises ToolInputError."""
+        result = {}
+        for p in self.params:
+            value = arguments.get(p.name, p.default)
+            if p.validator is not None and value is not None:
+                try:
+                    value = p.validator(value)
+                except ToolInputError as e:
+                    raise ToolInputError(p.name, e.message) from None
+            result[p.name] = value
+        for check in self.checks:
+            check(result)
+        return result
+
+    def render_path(self, arguments: Dict[str, Any]) -> str:
+        return "".join(
+            literal + (quote(str(arguments[field]), safe="") if field else "")
+            for literal, field in self._segments
         )
-        response.raise_for_status()
 
-        return response.json()
+    def query(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        return {name: arguments[name] for name in self.query_params if arguments.get(name) is not None}
+
+    def _render_docstring(self) -> str:
+        args = ["    context: MCP context (auto-injected by framework, not user-provided)"]
+        for p in self.params:
+            default = "" if p.default is None else f", default: {json.dumps(p.default)}"
+            args.append(f"    {p.name}: {p.description} (optional{default})")
+        example = ", ".join(f"{p.name}={json.dumps(p.default)}" for p in self.params if p.location == "path")
+        return (
+            f"{self.description}\n\n"
+            f"Generated from OpenAPI endpoint: GET {self.path}\n\n"
+            f"Args:\n" + "\n".join(args) + "\n\n"
+            f"Returns:\n    API response (dict, list, or other JSON type)\n\n"
+            f"Example Usage:\n    await {self.name}({example})\n\n"
+            f"    Note: 'context' parameter is auto-injected by MCP framework\n"
+        )
 
-    except Exception as e:
-        logger.error(f"Error in retrieve_all_upcoming_public_holidays_occurring_within_the_next_365_days_for_a_given_country: {e}")
-        return {"error": str(e), "endpoint": "/api/v3/NextPublicHolidays/{countryCode}"}
 
+class ResponseCache:
+    """Bounded TTL cache of upstream results, only touched from the event loop."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "collections.OrderedDict[Any, Tuple[float, Any]]" = collections.OrderedDict()
+
+    def get(self, key: Any) -> Tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def put(self, key: Any, value: Any, ttl: float) -> None:
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES)
+
+_http = requests.Session()
+_http.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=UPSTREAM_POOL_SIZE))
+_http.mount("http://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=UPSTREAM_POOL_SIZE))
+_upstream_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=UPSTREAM_POOL_SIZE, thread_name_prefix="upstream"
+)
 
-@mcp.tool()
-@require_payment_for_tool(
-    price=TokenAmount(
-        amount="1000000000000000",  # 0.001 tokens
-        asset=TokenAsset(
-            address="0x3e17730bb2ca51a8D5deD7E44c003A2e95a4d822",
-            decimals=18,
-            network="sepolia",
-            eip712=EIP712Domain(
-                name="IATPWallet",
-                version="1"
-            )
-        )
-    ),
-    description="This global endpoint aggregates upcoming holidays "
 
-)
-async def retrieve_all_public_holidays_occurring_worldwide_within_the_next_7_days(
-    context: Context
-) -> Any:
-    """
-    This global endpoint aggregates upcoming holidays across all supported countries, enabling international systems to detect near-term events.
+class Mirror:
+    """One upstream base URL and its health: latency and success-rate EWMAs, consecutive failures."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.host = urlsplit(base_url).netloc or base_url
+        self.ewma_s: Optional[float] = None
+        self.success_rate = 1.0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    def describe(self, now: float) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "ewma_ms": None if self.ewma_s is None else round(self.ewma_s * 1000, 1),
+            "success_rate": round(self.success_rate, 3),
+            "consecutive_failures": self.consecutive_failures,
+            "ejected": self.ejected_until > now,
+        }
 
-    Generated from OpenAPI endpoint: GET /api/v3/NextPublicHolidaysWorldwide
 
-    Args:
-        context: MCP context (auto-injected by framework, not user-provided)
+class UpstreamPool:
+    """Picks a Nager.Date mirror per attempt, weighted towards lower latency.
+
+    Each mirror keeps EWMAs of its successful response times and of its
+    success rate; attempt order is a weighted shuffle with weight
+    success rate / latency, so fast, reliable mirrors take most traffic while
+    the others still get enough to notice when they recover. Failures only
+    lower the success rate, so a mirror that fails fast never looks fast, and
+    a single error costs a share of traffic rather than all of it. Mirrors
+    not measured yet are weighted like an average working one. Removing a
+    mirror is left to ejection: mirrors that fail UPSTREAM_EJECT_AFTER times
+    in a row (5xx, 429, timeouts, connection errors) are ejected for
+    UPSTREAM_EJECT_SECONDS and only tried after every healthy mirror has
+    failed.
+    """
 
+    def __init__(self, base_urls: Sequence[str], alpha: float, eject_after: int, eject_seconds: float):
+        self.mirrors = [Mirror(url) for url in base_urls]
+        self.alpha = alpha
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self._lock = threading.Lock()
+
+    def candidates(self) -> List[Mirror]:
+        """Mirrors in the order they should be tried for one call."""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [m for m in self.mirrors if m.ejected_until <= now]
+            ejected = sorted((m for m in self.mirrors if m.ejected_until > now), key=lambda m: m.ejected_until)
+            known = [m.ewma_s for m in healthy if m.ewma_s is not None]
+            # Unmeasured mirrors are weighted like an average working one: tried
+            # regularly, but not preferred over a mirror known to be faster
+            working = [m.ewma_s for m in healthy if m.ewma_s is not None and not m.consecutive_failures] or known
+            default = sum(working) / len(working) if working else 1.0
+            weights = [
+                max(m.success_rate, 0.01) / max(m.ewma_s if m.ewma_s is not None else default, 0.001)
+                for m in healthy
+            ]
+        ordered = []
+        while healthy:
+            index = random.choices(range(len(healthy)), weights=weights)[0]
+            ordered.append(healthy.pop(index))
+            weights.pop(index)
+        return ordered + ejected
+
+    def record(self, mirror: Mirror, ok: bool, latency_s: float) -> None:
+        with self._lock:
+            mirror.success_rate = self.alpha * (1.0 if ok else 0.0) + (1 - self.alpha) * mirror.success_rate
+            if ok:
+                if mirror.ewma_s is None:
+                    mirror.ewma_s = latency_s
+                else:
+                    mirror.ewma_s = self.alpha * latency_s + (1 - self.alpha) * mirror.ewma_s
+                mirror.consecutive_failures = 0
+                mirror.ejected_until = 0.0
+                return
+            mirror.consecutive_failures += 1
+            if mirror.consecutive_failures >= self.eject_after and len(self.mirrors) > 1:
+                if mirror.ejected_until <= time.monotonic():
+                    logger.warning("Ejecting upstream %s for %.0fs after %d consecutive failures",
+                                   mirror.base_url, self.eject_seconds, mirror.consecutive_failures)
+                mirror.ejected_until = time.monotonic() + self.eject_seconds
+
+    def record_slow(self, mirror: Mirror, elapsed_s: float) -> None:
+        """A request given up on after `elapsed_s` without a verdict: a latency sample of at least that."""
+        with self._lock:
+            if mirror.ewma_s is None:
+                mirror.ewma_s = elapsed_s
+            elif elapsed_s > mirror.ewma_s:
+                mirror.ewma_s = self.alpha * elapsed_s + (1 - self.alpha) * mirror.ewma_s
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [m.describe(now) for m in self.mirrors]
+
+
+upstream_pool = UpstreamPool(NAGER_BASE_URLS, UPSTREAM_EWMA_ALPHA, UPSTREAM_EJECT_AFTER, UPSTREAM_EJECT_SECONDS)
+
+
+def _get_from_mirror(mirror: Mirror, path: str, params: Optional[Dict[str, Any]],
+                     timeout: float, capped: bool = False) -> Tuple[int, Any]:
+    """One traced GET against one mirror, recorded for readiness and mirror health.
+
+    `capped` means `timeout` was shortened to fit the caller's deadline, so
+    running into it is not held against the mirror.
+    """
+    url = f"{mirror.base_url}{path}"
+    with tracer.span(f"GET {mirror.host}", SPAN_KIND_CLIENT,
+                     attributes={"http.url": url, "upstream.mirror": mirror.base_url,
+                                 "upstream.timeout_ms": round(timeout * 1000)}) as span:
+        headers = {"traceparent": span.traceparent} if span is not None else {}
+        started = time.monotonic()
+        try:
+            response = _http.get(
+                url,
+                params=params,
+                headers=headers,
+                timeout=timeout
+            )
+        except requests.RequestException as e:
+            latency = time.monotonic() - started
+            # A timeout cut short by the caller's deadline only says the mirror is at least this slow
+            if isinstance(e, requests.Timeout) and capped:
+                upstream_pool.record_slow(mirror, latency)
+                raise
+            readiness.upstream.record(False, latency)
+            upstream_pool.record(mirror, False, latency)
+            raise
+        latency = time.monotonic() - started
+        # Client errors (unknown country, bad year) say nothing about upstream health
+        healthy = response.status_code < 500 and response.status_code != 429
+        readiness.upstream.record(healthy, latency)
+        upstream_pool.record(mirror, healthy, latency)
+        if span is not None:
+            span.attributes["http.status_code"] = response.status_code
+        response.raise_for_status()
+        return response.status_code, response.json() if response.content else None
 
-    Returns:
-        API response (dict, list, or other JSON type)
 
-    Example Usage:
-        await retrieve_all_public_holidays_occurring_worldwide_within_the_next_7_days()
+def call_nager_api(path: str, params: Optional[Dict[str, Any]] = None, deadline: Optional[float] = None,
+                   cancelled: Optional[threading.Event] = None) -> Tuple[int, Any]:
+    """GET a Nager.Date path, failing over across mirrors; returns (status, JSON body or None).
 
-        Note: 'context' parameter is auto-injected by MCP framework
+    Blocking: call from a worker thread. Retryable failures (5xx, 429,
+    timeouts, connection errors) move on to the next mirror, up to
+    UPSTREAM_MAX_ATTEMPTS; anything else is raised straight away. Each
+    attempt's timeout is capped by what is left until `deadline` (a
+    time.monotonic() value); an attempt that runs into that cap raises
+    DEADLINE_EXCEEDED rather than an upstream timeout. No new attempt starts
+    once `cancelled` is set or less than UPSTREAM_MIN_ATTEMPT_SECONDS remain.
+    """
+    last_error: Optional[BaseException] = None
+    for attempt, mirror in enumerate(upstream_pool.candidates()[:max(1, UPSTREAM_MAX_ATTEMPTS)]):
+        if cancelled is not None and cancelled.is_set():
+            raise ToolCallError(ToolCallError.CANCELLED, "tool call cancelled")
+        timeout = UPSTREAM_TIMEOUT
+        capped = False
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining < UPSTREAM_MIN_ATTEMPT_SECONDS:
+                message = f"deadline exceeded after {attempt} upstream attempt(s)"
+                if last_error is not None:
+                    message += f": {ToolCallError.from_exception(last_error)}"
+                raise ToolCallError(ToolCallError.DEADLINE_EXCEEDED, message)
+            capped = remaining < UPSTREAM_TIMEOUT
+            timeout = min(timeout, remaining)
+        if attempt:
+            logger.info("Failing over to %s after: %s", mirror.base_url, last_error)
+        try:
+            return _get_from_mirror(mirror, path, params, timeout, capped)
+        except requests.Timeout as e:
+            if not capped:
+                last_error = e
+                continue
+            # The caller's deadline ended this attempt, not the mirror
+            raise ToolCallError(
+                ToolCallError.DEADLINE_EXCEEDED, f"deadline exceeded after {attempt + 1} upstream attempt(s)"
+            ) from e
+        except Exception as e:
+            if not ToolCallError.from_exception(e).retryable:
+                raise
+            last_error = e
+    assert last_error is not None
+    raise last_error
+
+
+def _deadline_budget(context: Any) -> float:
+    """Seconds this tool call may take: the client's timeout if it sent one, capped at TOOL_MAX_DEADLINE.
+
+    Clients can send an `x-request-timeout-ms` header or a `timeoutMs` field in
+    the request's `_meta`; otherwise TOOL_DEFAULT_DEADLINE applies.
     """
-    # Payment already verified by @require_payment_for_tool decorator
-    # No authentication required for this API - api_key not needed
+    requested = None
+    request = _request_of(context)
+    if request is not None:
+        requested = request.headers.get("x-request-timeout-ms")
+    if requested is None:
+        try:
+            requested = getattr(context.request_context.meta, "timeoutMs", None)
+        except (AttributeError, LookupError, ValueError):
+            requested = None
+    try:
+        budget = float(requested) / 1000 if requested is not None else TOOL_DEFAULT_DEADLINE
+    except (TypeError, ValueError):
+        budget = TOOL_DEFAULT_DEADLINE
+    return min(budget, TOOL_MAX_DEADLINE) if budget > 0 else TOOL_DEFAULT_DEADLINE
+
 
+async def _call_upstream(context: Any, path: str, params: Dict[str, Any]) -> Tuple[int, Any]:
+    """Run call_nager_api() on the upstream pool, bounded by the call's deadline.
+
+    Returns early, and stops any further failover attempts, when the deadline
+    passes, the MCP request is cancelled (this coroutine is cancelled), or the
+    HTTP client disconnects. A request already on the wire finishes in its
+    worker thread, bounded by the remaining budget it was given.
+    """
+    budget = _deadline_budget(context)
+    tracer.set_attribute("deadline_ms", round(budget * 1000))
+    deadline = time.monotonic() + budget
+    cancelled = threading.Event()
+    loop = asyncio.get_running_loop()
+    call = functools.partial(call_nager_api, path, params, deadline, cancelled)
+    upstream = loop.run_in_executor(_upstream_executor, contextvars.copy_context().run, call)
+    # Retrieve the eventual result so an abandoned failure is not reported as unhandled
+    upstream.add_done_callback(lambda f: f.cancelled() or f.exception())
+    waiters: Set[asyncio.Future] = {upstream}
+    disconnected: Optional[asyncio.Event] = _request_state(context).get("client_disconnected")
+    disconnect_waiter = loop.create_task(disconnected.wait()) if disconnected is not None else None
+    if disconnect_waiter is not None:
+        waiters.add(disconnect_waiter)
     try:
-        url = f"https://date.nager.at/api/v3/NextPublicHolidaysWorldwide"
-        params = {}
-        headers = {}
-        # No auth required for this API
-
-        response = requests.get(
-            url,
-            params=params,
-            headers=headers,
-            timeout=30
-        )
-        response.raise_for_status()
+        done, _ = await asyncio.wait(waiters, timeout=budget, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        cancelled.set()
+        raise
+    finally:
+        if disconnect_waiter is not None:
+            disconnect_waiter.cancel()
+    if upstream in done:
+        return upstream.result()
+    cancelled.set()
+    if disconnect_waiter is not None and disconnect_waiter in done:
+        raise ToolCallError(ToolCallError.CANCELLED, "client disconnected")
+    raise ToolCallError(ToolCallError.DEADLINE_EXCEEDED, f"deadline of {budget:.1f}s exceeded")
+
+
+async def execute_endpoint(endpoint: Endpoint, context: Context, arguments: Dict[str, Any]) -> Any:
+    """Run one tool call: the single execution path shared by every endpoint."""
+    readiness.in_flight += 1
+    profiler.tool_started(endpoint.name)
+    parent = _request_state(context).get("trace_span")
+    try:
+        with tracer.span(f"tool {endpoint.name}", parent=parent, attributes={"mcp.tool": endpoint.name}):
+            if endpoint.local_source is not None:
+                local = endpoint.local_source()
+                if local is not None:
+                    tracer.set_attribute("cache", "hit")
+                    return local
+
+            try:
+                arguments = endpoint.canonicalize(arguments)
+            except ToolInputError as e:
+                raise e.to_tool_error(endpoint.path) from e
+            path = endpoint.render_path(arguments)
+            params = endpoint.query(arguments)
+            cache_key = (path, tuple(sorted(params.items())))
+            hit, cached = response_cache.get(cache_key)
+            if hit:
+                # Negative entries (cached upstream 4xx) are stored as the error itself
+                if isinstance(cached, ToolCallError):
+                    tracer.set_attribute("cache", "negative_hit")
+                    raise cached.to_tool_error(endpoint.path)
+                tracer.set_attribute("cache", "hit")
+                return cached
+            if endpoint.cache_ttl > 0:
+                tracer.set_attribute("cache", "miss")
+
+            try:
+                status, body = await _call_upstream(context, path, params)
+            except Exception as e:
+                error = ToolCallError.from_exception(e)
+                if error.kind == ToolCallError.UPSTREAM_CLIENT:
+                    logger.warning("Error in %s: %s", endpoint.name, e, extra={"tool": endpoint.name})
+                    if error.status is not None:
+                        response_cache.put(cache_key, error, NEGATIVE_CACHE_TTLS.get(error.status, 0))
+                elif error.kind == ToolCallError.CANCELLED:
+                    logger.info("Abandoned %s: %s", endpoint.name, error, extra={"tool": endpoint.name})
+                else:
+                    logger.error("Error in %s: %s", endpoint.name, e, extra={"tool": endpoint.name})
+                raise error.to_tool_error(endpoint.path) from e
+
+            result = endpoint.status_results.get(status, body)
+            response_cache.put(cache_key, result, endpoint.cache_ttl)
+            return result
+    finally:
+        profiler.tool_finished(endpoint.name)
+        readiness.in_flight -= 1
+
+
+class ClientDisconnectMiddleware:
+    """ASGI middleware that sets scope["state"]["client_disconnected"] when the client goes away.
+
+    It only observes the `http.disconnect` message as it passes through to
+    whoever is listening for it (the SSE response of a streamable-HTTP tool call).
+    """
 
-        return response.json()
+    def __init__(self, app):
+        self.app = app
 
-    except Exception as e:
-        logger.error(f"Error in retrieve_all_public_holidays_occurring_worldwide_within_the_next_7_days: {e}")
-        return {"error": str(e), "endpoint": "/api/v3/NextPublicHolidaysWorldwide"}
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        disconnected = asyncio.Event()
+        scope.setdefault("state", {})["client_disconnected"] = disconnected
 
+        async def watched_receive():
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            return message
 
-@mcp.tool()
-@require_payment_for_tool(
-    price=TokenAmount(
-        amount="1000000000000000",  # 0.001 tokens
-        asset=TokenAsset(
-            address="0x3e17730bb2ca51a8D5deD7E44c003A2e95a4d822",
-            decimals=18,
-            network="sepolia",
-            eip712=EIP712Domain(
-                name="IATPWallet",
-                version="1"
-            )
-        )
-    ),
-    description="This endpoint returns detailed version information"
+        await self.app(scope, watched_receive, send)
 
-)
-async def retrieve_the_current_version_information_of_the_nagerdate_library(
-    context: Context
-) -> Any:
-    """
-    This endpoint returns detailed version information about the Nager.Date implementation running on the server, including the exact NuGet package version used by the API.
 
-    Generated from OpenAPI endpoint: GET /api/v3/Version
+def register_endpoint(endpoint: Endpoint) -> Callable:
+    """Register `endpoint` as a paid MCP tool backed by execute_endpoint()."""
+    async def tool(context: Context, **arguments: Any) -> Any:
+        return await execute_endpoint(endpoint, context, arguments)
 
-    Args:
-        context: MCP context (auto-injected by framework, not user-provided)
+    tool.__name__ = tool.__qualname__ = endpoint.name
+    tool.__doc__ = endpoint.docstring
+    tool.__signature__ = endpoint.signature
+    tool.__annotations__ = {
+        "context": Context, **{p.name: p.annotation for p in endpoint.params}, "return": Any
+    }
+    paid = require_payment_for_tool(price=TOOL_PRICE, description=endpoint.description[:50])(tool)
+    return mcp.tool()(paid)
 
 
-    Returns:
-        API response (dict, list, or other JSON type)
+# ============================================================================
+# TOOL IMPLEMENTATIONS
+# ============================================================================
+# Tools are declared as rows of ENDPOINTS and registered through
+# register_endpoint(), which applies @mcp.tool() and @require_payment_for_tool()
 
-    Example Usage:
-        await retrieve_the_current_version_information_of_the_nagerdate_library()
 
-        Note: 'context' parameter is auto-injected by MCP framework
-    """
-    # Payment already verified by @require_payment_for_tool decorator
-    # No authentication required for this API - api_key not needed
+# D402 Payment Middleware
+# The HTTP 402 payment protocol middleware is already configured in the server initialization.
+# It's imported from traia_iatp.d402.mcp_middleware and auto-detects configuration from:
+# - PAYMENT_ADDRESS or EVM_ADDRESS: Where to receive payments
+# - EVM_NETWORK: Blockchain network (default: base-sepolia)
+# - DEFAULT_PRICE_USD: Price per request (default: $0.001)
+# - TEST_SKIP_SKILL_1772170590_API_KEY: Server's internal API key for payment mode
+#
+# All payment verification logic is handled by the traia_iatp.d402 module.
+# No custom implementation needed!
 
-    try:
-        url = f"https://date.nager.at/api/v3/Version"
-        params = {}
-        headers = {}
-        # No auth required for this API
-
-        response = requests.get(
-            url,
-            params=params,
-            headers=headers,
-            timeout=30
+
+# API Endpoint Tool Implementations
+
+# Price charged per tool call via @require_payment_for_tool
+TOOL_PRICE = TokenAmount(
+    amount="1000000000000000",  # 0.001 tokens
+    asset=TokenAsset(
+        address="0x3e17730bb2ca51a8D5deD7E44c003A2e95a4d822",
+        decimals=18,
+        network="sepolia",
+        eip712=EIP712Domain(
+            name="IATPWallet",
+            version="1"
         )
-        response.raise_for_status()
+    )
+)
 
-        return response.json()
+ENDPOINTS: Tuple[Endpoint, ...] = (
+    Endpoint(
+        name="retrieves_detailed_information_about_a_specific_country",
+        path="/api/v3/CountryInfo/{countryCode}",
+        description="Provide a valid `ISO 3166-1 alpha-2` country code to retrieve country metadata. The response includes commonly used and official country names, the assigned region, and if available neighboring countries based on geographical borders.",
+        params=[
+            Param("countryCode", str, "us", "path", 'The 2-letter ISO 3166-1 country code (e.g., "US", "GB").', validate_country_code),
+        ],
+        cache_ttl=86400,
+    ),
+    Endpoint(
+        name="retrieve_the_complete_list_of_all_countries_supported_by_the_nagerdate_api",
+        path="/api/v3/AvailableCountries",
+        description="This endpoint returns all countries for which public-holiday data is available. Each entry includes the country's name and ISO code.",
+        cache_ttl=COUNTRY_CACHE_TTL,
+        local_source=lambda: readiness.countries.countries if readiness.countries.fresh else None,
+    ),
+    Endpoint(
+        name="retrieve_all_long_weekends_for_a_given_country_and_year",
+        path="/api/v3/LongWeekend/{year}/{countryCode}",
+        description="A long weekend is calculated based on public holidays that create an extended break of at least three consecutive days. Optional bridge days-weekdays between a holiday and a weekend-can be included to identify potential extended leave opportunities.",
+        params=[
+            Param("year", int, 2026, "path", "The target year for which long-weekend data should be calculated.", validate_year),
+            Param("countryCode", str, "us", "path", "A valid `ISO 3166-1 alpha-2` country code determining the region of interest.", validate_country_code),
+            Param("availableBridgeDays", int, 1, "query", "The maximum number of bridge days to include when determining long-weekend opportunities.", validate_bridge_days),
+            Param("subdivisionCode", Optional[str], None, "query", "Narrow the calculation to a specific federal state, province, or subdivision (where supported).", validate_subdivision_code),
+        ],
+        checks=[subdivision_in_country("subdivisionCode")],
+        cache_ttl=86400,
+    ),
+    Endpoint(
+        name="retrieve_the_list_of_all_public_holidays_for_the_specified_year_and_country",
+        path="/api/v3/PublicHolidays/{year}/{countryCode}",
+        description="This endpoint returns all officially recognized public holidays for the given country and year. Each holiday entry includes the local and English holiday names, information about whether the holiday applies nationally or only in specific subdivisions, and the associated holiday type classifications.",
+        params=[
+            Param("year", int, 2026, "path", "The target year for which public holidays should be retrieved.", validate_year),
+            Param("countryCode", str, "us", "path", "A valid `ISO 3166-1 alpha-2` country code.", validate_country_code),
+        ],
+        cache_ttl=86400,
+    ),
+    Endpoint(
+        name="determines_whether_today_is_a_public_holiday_in_the_specified_country_optionally_adjusted_by_a_utc_offset",
+        path="/api/v3/IsTodayPublicHoliday/{countryCode}",
+        description='By default, the calculation is based on the current UTC date. You may optionally provide a timezone offset to evaluate the holiday status relative to a different local timezone. This endpoint is optimized for simple command-line or automation workflows where only the HTTP status code is required ``` STATUSCODE=$(curl --silent --output /dev/stderr --write-out "%{http_code}" https://date.nager.at/Api/v3/IsTodayPublicHoliday/AT) if [ $STATUSCODE -ne 200 ]; then # handle error fi ```',
+        params=[
+            Param("countryCode", str, "us", "path", "A valid `ISO 3166-1 alpha-2` country code.", validate_country_code),
+            Param("countyCode", Optional[str], None, "query", "Optional. The subdivision code (e.g., state, province) to narrow the check.", validate_subdivision_code),
+            Param("offset", int, 0, "query", "Optional. UTC timezone offset in hours (range: -12 to +12).", validate_utc_offset),
+        ],
+        checks=[subdivision_in_country("countyCode")],
+        # Answered by status code only: 200 = public holiday, 204 = not one
+        cache_ttl=60,
+        status_results={200: {"isPublicHoliday": True}, 204: {"isPublicHoliday": False}},
+    ),
+    Endpoint(
+        name="retrieve_all_upcoming_public_holidays_occurring_within_the_next_365_days_for_a_given_country",
+        path="/api/v3/NextPublicHolidays/{countryCode}",
+        description="The list includes only future holidays relative to the current date and is useful for forecasting, event planning, and applications that provide forward-looking holiday insights.",
+        params=[
+            Param("countryCode", str, "us", "path", "A valid `ISO 3166-1 alpha-2` country code.", validate_country_code),
+        ],
+        cache_ttl=3600,
+    ),
+    Endpoint(
+        name="retrieve_all_public_holidays_occurring_worldwide_within_the_next_7_days",
+        path="/api/v3/NextPublicHolidaysWorldwide",
+        description="This global endpoint aggregates upcoming holidays across all supported countries, enabling international systems to detect near-term events.",
+        cache_ttl=3600,
+    ),
+    Endpoint(
+        name="retrieve_the_current_version_information_of_the_nagerdate_library",
+        path="/api/v3/Version",
+        description="This endpoint returns detailed version information about the Nager.Date implementation running on the server, including the exact NuGet package version used by the API.",
+        cache_ttl=3600,
+    ),
+)
 
-    except Exception as e:
-        logger.error(f"Error in retrieve_the_current_version_information_of_the_nagerdate_library: {e}")
-        return {"error": str(e), "endpoint": "/api/v3/Version"}
+for endpoint in ENDPOINTS:
+    register_endpoint(endpoint)
+ENDPOINTS_BY_NAME: Dict[str, Endpoint] = {endpoint.name: endpoint for endpoint in ENDPOINTS}
 
 
 # TODO: Add your API-specific functions here
@@ -658,6 +1876,9 @@ def create_app_with_middleware():
         logger.warning("⚠️  D402 Testing Mode - Facilitator bypassed")
     logger.info("="*60)
     
+    # Trace FastMCP dispatch (innermost, wraps the routed /mcp app)
+    app.add_middleware(TracingMiddleware, stage="fastmcp.dispatch")
+
     # Add CORS middleware first (processes before other middleware)
     app.add_middleware(
         CORSMiddleware,
@@ -668,6 +1889,7 @@ def create_app_with_middleware():
         expose_headers=["mcp-session-id"],  # Expose custom headers to browser
     )
     logger.info("✅ Added CORS middleware (allow all origins, expose mcp-session-id)")
+    app.add_middleware(TracingMiddleware, stage="middleware.cors")
     
     # Add D402 payment middleware with extracted configs
     app.add_middleware(
@@ -683,6 +1905,19 @@ def create_app_with_middleware():
     )
     logger.info("✅ Added D402PaymentMiddleware")
     logger.info("   - Payment-only mode")
+    app.add_middleware(TracingMiddleware, stage="middleware.d402")
+
+    # Reject invalid tool arguments before D402PaymentMiddleware charges for them
+    app.add_middleware(PrePaymentValidationMiddleware)
+    logger.info("✅ Added PrePaymentValidationMiddleware")
+
+    # Root request span (outermost, so it covers every stage above)
+    app.add_middleware(TracingMiddleware)
+    if tracer.enabled:
+        logger.info(f"✅ Added request tracing (exporter={TRACE_EXPORTER}, sample rate={TRACE_SAMPLE_RATE})")
+
+    # Let tool calls notice client disconnects and stop waiting on the upstream
+    app.add_middleware(ClientDisconnectMiddleware)
     
     # Add health check endpoint (bypasses middleware)
     @app.route("/health", methods=["GET"])
@@ -696,7 +1931,79 @@ def create_app_with_middleware():
             }
         )
     logger.info("✅ Added /health endpoint")
-    
+
+    # Add readiness endpoint (cheap: only reads signals sampled in the background)
+    @app.route("/ready", methods=["GET"])
+    async def readiness_check(request: Request) -> JSONResponse:
+        """Readiness endpoint for load balancers; 503 while any signal is over threshold."""
+        ready, checks = readiness.evaluate()
+        return JSONResponse(
+            content={
+                "status": "ready" if ready else "not_ready",
+                "service": "test-skip-skill-1772170590-mcp-server",
+                "checks": checks,
+                "timestamp": datetime.now().isoformat()
+            },
+            status_code=200 if ready else 503
+        )
+    logger.info("✅ Added /ready endpoint")
+
+    # Add admin profiling hook (disabled unless ADMIN_TOKEN is set)
+    @app.route("/admin/profile", methods=["GET", "POST", "DELETE"])
+    async def admin_profile(request: Request) -> JSONResponse:
+        """Start (POST), inspect (GET) or stop (DELETE) a profiling window."""
+        if not _admin_authorized(request):
+            return JSONResponse(content={"error": "not found"}, status_code=404)
+
+        session = profiler.session
+        if request.method == "GET":
+            return JSONResponse(content={"session": session.describe() if session is not None else None})
+
+        if request.method == "DELETE":
+            profiler.stop()
+            return JSONResponse(content={"session": session.describe() if session is not None else None})
+
+        if session is not None and not session.done:
+            return JSONResponse(
+                content={"error": "profiling already running", "session": session.describe()},
+                status_code=409
+            )
+        try:
+            body = await request.json() if await request.body() else {}
+            mode = body.get("mode", "sampling")
+            seconds = float(body.get("seconds", 30))
+            tool = body.get("tool")
+        except (ValueError, TypeError, AttributeError):
+            return JSONResponse(content={"error": "expected JSON body {mode, seconds, tool}"}, status_code=400)
+        if mode not in PROFILE_MODES:
+            return JSONResponse(content={"error": f"mode must be one of {list(PROFILE_MODES)}"}, status_code=400)
+        if not 0 < seconds <= PROFILE_MAX_SECONDS:
+            return JSONResponse(content={"error": f"seconds must be in (0, {PROFILE_MAX_SECONDS}]"}, status_code=400)
+        if tool is not None and tool not in {t.name for t in await mcp.list_tools()}:
+            return JSONResponse(content={"error": f"unknown tool: {tool}"}, status_code=400)
+
+        session = profiler.start(mode, seconds, tool)
+        return JSONResponse(content={"session": session.describe()}, status_code=202)
+    logger.info(f"✅ Added /admin/profile endpoint ({'enabled' if ADMIN_TOKEN else 'disabled, ADMIN_TOKEN not set'})")
+
+    # Start readiness samplers and the trace exporter alongside FastMCP's own lifespan
+    mcp_lifespan = app.router.lifespan_context
+
+    @contextlib.asynccontextmanager
+    async def lifespan(lifespan_app: Starlette) -> AsyncIterator[Optional[Mapping[str, Any]]]:
+        tracer.start()
+        await readiness.start(facilitator_url)
+        try:
+            async with mcp_lifespan(lifespan_app) as state:
+                yield state
+        finally:
+            profiler.stop()
+            await readiness.stop()
+            await asyncio.to_thread(tracer.stop)
+
+    # Yields FastMCP's own state, if any, so it is stateful or stateless just like FastMCP's
+    app.router.lifespan_context = cast("Lifespan[Starlette]", lifespan)
+
     return app
 
 if __name__ == "__main__":
@@ -713,9 +2020,13 @@ if __name__ == "__main__":
     app = create_app_with_middleware()
     
     # Run with uvicorn
+    # With the custom pipeline, uvicorn's loggers propagate to it instead of
+    # writing to the console synchronously through uvicorn's own handlers
+    custom_logging = LOG_ASYNC or LOG_FORMAT == "json"
     uvicorn.run(
         app,
         host="0.0.0.0",
         port=PORT,
-        log_level=os.getenv("LOG_LEVEL", "info").lower()
+        log_level=os.getenv("LOG_LEVEL", "info").lower(),
+        log_config=None if custom_logging else uvicorn.config.LOGGING_CONFIG
     )
@@ -0,0 +1,6 @@
+"""Test setup: server.py reads its configuration when it is imported."""
+import os
+
+os.environ.setdefault("SERVER_ADDRESS", "0x0000000000000000000000000000000000000001")
+os.environ.setdefault("D402_TESTING_MODE", "true")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
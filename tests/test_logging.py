@@ -0,0 +1,82 @@
+"""Rate limiting of repeated warnings and errors by RepeatedErrorFilter."""
+import logging
+import time
+
+import pytest
+
+server = pytest.importorskip("server")
+
+
+def _record(msg, level=logging.WARNING, name="test", args=(), **extra):
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def _passed(log_filter, records):
+    return [record for record in records if log_filter.filter(record)]
+
+
+def test_burst_is_let_through_and_the_rest_suppressed():
+    log_filter = server.RepeatedErrorFilter(burst=3, window=60)
+
+    passed = _passed(log_filter, [_record("upstream failed: %s", args=(i,)) for i in range(5)])
+
+    assert len(passed) == 3
+
+
+def test_suppressed_count_is_reported_after_the_window():
+    log_filter = server.RepeatedErrorFilter(burst=2, window=0.05)
+    _passed(log_filter, [_record("upstream failed") for _ in range(5)])
+    time.sleep(0.06)
+
+    record = _record("upstream failed")
+
+    assert log_filter.filter(record)
+    assert record.suppressed == 3
+    formatted = server.TextFormatter("%(message)s").format(record)
+    assert formatted == "upstream failed (3 similar messages suppressed)"
+    # The count is reported once, then the new window starts clean
+    second = _record("upstream failed")
+    assert log_filter.filter(second)
+    assert not getattr(second, "suppressed", 0)
+
+
+def test_keys_on_tool_and_template():
+    log_filter = server.RepeatedErrorFilter(burst=1, window=60)
+
+    assert log_filter.filter(_record("Error in %s", tool="a"))
+    assert log_filter.filter(_record("Error in %s", tool="b"))
+    assert log_filter.filter(_record("Another error", tool="a"))
+    assert not log_filter.filter(_record("Error in %s", tool="a"))
+
+
+def test_info_and_debug_are_never_suppressed():
+    log_filter = server.RepeatedErrorFilter(burst=1, window=60)
+
+    assert len(_passed(log_filter, [_record("tick", level=logging.INFO) for _ in range(5)])) == 5
+
+
+def test_non_string_messages_are_keyed_on_their_text():
+    log_filter = server.RepeatedErrorFilter(burst=1, window=60)
+
+    assert log_filter.filter(_record({"a": 1}))
+    assert log_filter.filter(_record({"a": 2}))
+    assert not log_filter.filter(_record({"a": 1}))
+
+
+def test_unkeyable_records_are_let_through():
+    class Unprintable:
+        def __str__(self):
+            raise RuntimeError("no text")
+
+    log_filter = server.RepeatedErrorFilter(burst=1, window=60)
+
+    assert log_filter.filter(_record(Unprintable()))
+    assert log_filter.filter(_record(Unprintable()))
+
+
+def test_logging_a_dict_through_the_root_handler_does_not_raise():
+    assert any(isinstance(f, server.RepeatedErrorFilter) for h in logging.getLogger().handlers for f in h.filters)
+
+    logging.getLogger("third.party").warning({"a": 1})
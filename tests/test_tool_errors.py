@@ -0,0 +1,76 @@
+"""Classification of upstream failures into client-facing tool errors."""
+import json
+
+import pytest
+import requests
+
+server = pytest.importorskip("server")
+
+ToolCallError = server.ToolCallError
+MIRROR_URL = "https://mirror.internal.example/api/v3/PublicHolidays/2026/US"
+
+
+def _http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    response.url = MIRROR_URL
+    return requests.HTTPError(f"{status} Error for url: {MIRROR_URL}", response=response)
+
+
+@pytest.mark.parametrize("status, kind, retryable", [
+    (400, ToolCallError.UPSTREAM_CLIENT, False),
+    (404, ToolCallError.UPSTREAM_CLIENT, False),
+    (429, ToolCallError.UPSTREAM_RATE_LIMITED, True),
+    (500, ToolCallError.UPSTREAM_SERVER, True),
+    (503, ToolCallError.UPSTREAM_SERVER, True),
+])
+def test_http_errors_are_classified_by_status(status, kind, retryable):
+    error = ToolCallError.from_exception(_http_error(status))
+
+    assert (error.kind, error.status, error.retryable) == (kind, status, retryable)
+
+
+@pytest.mark.parametrize("exception, kind", [
+    (requests.ConnectTimeout(f"timed out: {MIRROR_URL}"), ToolCallError.UPSTREAM_TIMEOUT),
+    (requests.ReadTimeout(f"timed out: {MIRROR_URL}"), ToolCallError.UPSTREAM_TIMEOUT),
+    (requests.ConnectionError(f"refused: {MIRROR_URL}"), ToolCallError.UPSTREAM_UNAVAILABLE),
+    (ValueError("Expecting value: line 1 column 1"), ToolCallError.UPSTREAM_INVALID_RESPONSE),
+    (RuntimeError("boom"), ToolCallError.INTERNAL),
+])
+def test_other_failures_are_classified(exception, kind):
+    assert ToolCallError.from_exception(exception).kind == kind
+
+
+def test_tool_call_errors_pass_through():
+    error = ToolCallError(ToolCallError.DEADLINE_EXCEEDED, "deadline of 1.0s exceeded")
+
+    assert ToolCallError.from_exception(error) is error
+    assert error.retryable
+
+
+@pytest.mark.parametrize("exception", [
+    _http_error(404),
+    _http_error(503),
+    requests.ReadTimeout(f"timed out: {MIRROR_URL}"),
+    requests.ConnectionError(f"refused: {MIRROR_URL}"),
+])
+def test_client_payload_does_not_name_the_mirror(exception):
+    payload = ToolCallError.from_exception(exception).to_dict("/api/v3/PublicHolidays/{year}/{countryCode}")
+
+    assert "mirror.internal.example" not in json.dumps(payload)
+    assert payload["endpoint"] == "/api/v3/PublicHolidays/{year}/{countryCode}"
+
+
+def test_tool_error_carries_the_payload():
+    error = ToolCallError.from_exception(_http_error(404))
+
+    tool_error = error.to_tool_error("/api/v3/CountryInfo/{countryCode}")
+
+    assert isinstance(tool_error, server.ToolError)
+    assert json.loads(str(tool_error)) == {
+        "error": "upstream returned HTTP 404",
+        "error_type": "upstream_client_error",
+        "retryable": False,
+        "endpoint": "/api/v3/CountryInfo/{countryCode}",
+        "status": 404,
+    }
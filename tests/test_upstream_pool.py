@@ -0,0 +1,297 @@
+"""Mirror selection, ejection, failover and deadlines against local stand-in Nager.Date servers."""
+import asyncio
+import collections
+import http.server
+import json
+import threading
+import time
+import types
+
+import pytest
+import requests
+
+server = pytest.importorskip("server")
+
+COUNTRIES = [{"countryCode": "DE", "name": "Germany"}]
+
+
+class _StandInHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        stand_in = self.server
+        stand_in.hits += 1
+        failing = stand_in.behaviour == "error" or stand_in.fail_next > 0
+        stand_in.fail_next = max(0, stand_in.fail_next - 1)
+        if stand_in.behaviour == "hang":
+            stand_in.release.wait(10)
+            return
+        if stand_in.delay:
+            time.sleep(stand_in.delay)
+        status = 503 if failing else 200
+        body = json.dumps(COUNTRIES if status == 200 else {"error": "unavailable"}).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _StandInServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, behaviour: str, delay: float = 0.0):
+        super().__init__(("127.0.0.1", 0), _StandInHandler)
+        self.behaviour = behaviour
+        self.delay = delay
+        self.hits = 0
+        self.fail_next = 0
+        self.release = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def handle_error(self, request, client_address):
+        # The client gave up on a hung request; nothing to report
+        pass
+
+
+@pytest.fixture
+def stand_in():
+    """Start a stand-in server: "ok", "error" (always 503) or "hang" (never answers)."""
+    started = []
+
+    def start(behaviour: str, delay: float = 0.0) -> _StandInServer:
+        httpd = _StandInServer(behaviour, delay)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        started.append(httpd)
+        return httpd
+
+    yield start
+    for httpd in started:
+        httpd.release.set()
+        httpd.shutdown()
+        httpd.server_close()
+
+
+@pytest.fixture
+def use_mirrors(monkeypatch):
+    """Point call_nager_api() at a fresh pool over the given stand-ins."""
+    def use(*stand_ins: _StandInServer):
+        pool = server.UpstreamPool([s.base_url for s in stand_ins], alpha=0.3, eject_after=3, eject_seconds=60)
+        monkeypatch.setattr(server, "upstream_pool", pool)
+        return pool
+    return use
+
+
+def _mirror(pool, stand_in):
+    return next(m for m in pool.mirrors if m.base_url == stand_in.base_url)
+
+
+def _call_until_ejected(pool, bad, calls=40):
+    for _ in range(calls):
+        status, body = server.call_nager_api("/api/v3/AvailableCountries")
+        assert (status, body) == (200, COUNTRIES)
+        if _mirror(pool, bad).ejected_until:
+            return
+    pytest.fail("failing mirror was never ejected")
+
+
+def test_failing_mirror_is_ejected_and_calls_fail_over(stand_in, use_mirrors):
+    broken, healthy = stand_in("error"), stand_in("ok")
+    pool = use_mirrors(broken, healthy)
+
+    _call_until_ejected(pool, broken)
+
+    assert [m.base_url for m in pool.candidates()] == [healthy.base_url, broken.base_url]
+    snapshot = {m["base_url"]: m for m in pool.snapshot()}
+    assert snapshot[broken.base_url]["ejected"] is True
+    assert snapshot[healthy.base_url]["consecutive_failures"] == 0
+    # Fast 503s must not make the broken mirror look fast
+    assert _mirror(pool, broken).ewma_s is None
+    assert snapshot[broken.base_url]["success_rate"] < 0.5
+    hits = broken.hits
+    server.call_nager_api("/api/v3/AvailableCountries")
+    assert broken.hits == hits
+
+
+def test_hung_mirror_times_out_and_is_ejected(stand_in, use_mirrors, monkeypatch):
+    monkeypatch.setattr(server, "UPSTREAM_TIMEOUT", 0.3)
+    hung, healthy = stand_in("hang"), stand_in("ok")
+    pool = use_mirrors(hung, healthy)
+
+    _call_until_ejected(pool, hung)
+
+    assert _mirror(pool, hung).success_rate < 0.5
+    assert pool.candidates()[0].base_url == healthy.base_url
+
+
+def test_timeout_capped_by_deadline_is_not_a_failure(stand_in, use_mirrors, monkeypatch):
+    monkeypatch.setattr(server, "UPSTREAM_TIMEOUT", 5.0)
+    hung = stand_in("hang")
+    pool = use_mirrors(hung)
+
+    with pytest.raises(server.ToolCallError) as exc:
+        server.call_nager_api("/api/v3/AvailableCountries", deadline=time.monotonic() + 0.3)
+
+    assert exc.value.kind == server.ToolCallError.DEADLINE_EXCEEDED
+    mirror = _mirror(pool, hung)
+    assert mirror.consecutive_failures == 0
+    assert mirror.ewma_s is not None and mirror.ewma_s >= 0.25
+
+
+def test_selection_prefers_the_faster_mirror(stand_in, use_mirrors):
+    slow, fast = stand_in("ok", delay=0.2), stand_in("ok")
+    pool = use_mirrors(slow, fast)
+    for stand in (slow, fast):
+        for _ in range(3):
+            server._get_from_mirror(_mirror(pool, stand), "/api/v3/AvailableCountries", None, 5.0)
+
+    first = collections.Counter(pool.candidates()[0].base_url for _ in range(1000))
+
+    assert first[fast.base_url] > 800
+    assert first[slow.base_url] > 0
+
+
+def _first_choice_share(pool, stand_in, rounds=2000):
+    first = collections.Counter(pool.candidates()[0].base_url for _ in range(rounds))
+    return first[stand_in.base_url] / rounds
+
+
+def test_one_failure_costs_a_share_of_traffic_not_all_of_it(stand_in, use_mirrors):
+    slow, fast = stand_in("ok", delay=0.2), stand_in("ok")
+    pool = use_mirrors(slow, fast)
+    for stand in (slow, fast):
+        for _ in range(3):
+            server._get_from_mirror(_mirror(pool, stand), "/api/v3/AvailableCountries", None, 5.0)
+
+    fast.fail_next = 1
+    with pytest.raises(requests.HTTPError):
+        server._get_from_mirror(_mirror(pool, fast), "/api/v3/AvailableCountries", None, 5.0)
+
+    # Still the preferred mirror and not ejected: one transient error is not an outage
+    assert not _mirror(pool, fast).ejected_until
+    assert _first_choice_share(pool, fast) > 0.75
+    server._get_from_mirror(_mirror(pool, fast), "/api/v3/AvailableCountries", None, 5.0)
+    assert _mirror(pool, fast).consecutive_failures == 0
+    assert _first_choice_share(pool, fast) > 0.85
+
+
+def test_unmeasured_mirror_is_not_preferred(stand_in, use_mirrors):
+    fast, fresh = stand_in("ok"), stand_in("ok")
+    pool = use_mirrors(fast, fresh)
+    pool.record(_mirror(pool, fast), True, 0.01)
+
+    first = collections.Counter(pool.candidates()[0].base_url for _ in range(2000))
+
+    # Weighted like the average working mirror: an even share, not all of it
+    assert 800 < first[fresh.base_url] < 1200
+
+
+def _context(headers=None, timeout_ms=None, state=None):
+    """The parts of a FastMCP Context the deadline code reads."""
+    request = types.SimpleNamespace(headers=headers or {}, scope={"state": state if state is not None else {}})
+    meta = types.SimpleNamespace(timeoutMs=timeout_ms) if timeout_ms is not None else None
+    return types.SimpleNamespace(request_context=types.SimpleNamespace(request=request, meta=meta))
+
+
+@pytest.mark.parametrize("context, expected", [
+    (_context(headers={"x-request-timeout-ms": "1500"}), 1.5),
+    (_context(timeout_ms=2000), 2.0),
+    (_context(headers={"x-request-timeout-ms": "1500"}, timeout_ms=2000), 1.5),
+    (_context(headers={"x-request-timeout-ms": "3600000"}), "max"),
+    (_context(), "default"),
+    (_context(headers={"x-request-timeout-ms": "soon"}), "default"),
+    (_context(headers={"x-request-timeout-ms": "0"}), "default"),
+    (_context(timeout_ms=-5), "default"),
+    (types.SimpleNamespace(), "default"),
+])
+def test_deadline_budget(context, expected):
+    expected = {"max": server.TOOL_MAX_DEADLINE, "default": server.TOOL_DEFAULT_DEADLINE}.get(expected, expected)
+
+    assert server._deadline_budget(context) == expected
+
+
+def test_no_attempt_starts_without_enough_budget(stand_in, use_mirrors):
+    healthy = stand_in("ok")
+    use_mirrors(healthy)
+
+    with pytest.raises(server.ToolCallError) as exc:
+        server.call_nager_api("/api/v3/AvailableCountries", deadline=time.monotonic() + 0.1)
+
+    assert exc.value.kind == server.ToolCallError.DEADLINE_EXCEEDED
+    assert healthy.hits == 0
+
+
+def test_deadline_stops_failover(stand_in, use_mirrors, monkeypatch):
+    monkeypatch.setattr(server, "UPSTREAM_TIMEOUT", 0.3)
+    first, second = stand_in("hang"), stand_in("hang")
+    use_mirrors(first, second)
+
+    with pytest.raises(server.ToolCallError) as exc:
+        server.call_nager_api("/api/v3/AvailableCountries", deadline=time.monotonic() + 0.45)
+
+    # The first attempt used its full timeout; the 0.15s left is below UPSTREAM_MIN_ATTEMPT_SECONDS
+    assert exc.value.kind == server.ToolCallError.DEADLINE_EXCEEDED
+    assert str(exc.value) == "deadline exceeded after 1 upstream attempt(s): upstream request timed out"
+    assert first.hits + second.hits == 1
+
+
+def test_call_returns_at_the_deadline(stand_in, use_mirrors, monkeypatch):
+    monkeypatch.setattr(server, "UPSTREAM_TIMEOUT", 5.0)
+    use_mirrors(stand_in("hang"))
+    started = time.monotonic()
+
+    with pytest.raises(server.ToolCallError) as exc:
+        asyncio.run(server._call_upstream(
+            _context(headers={"x-request-timeout-ms": "500"}), "/api/v3/AvailableCountries", {}
+        ))
+
+    assert exc.value.kind == server.ToolCallError.DEADLINE_EXCEEDED
+    assert 0.45 < time.monotonic() - started < 1.0
+
+
+def test_client_disconnect_ends_the_call_and_frees_its_slot(stand_in, use_mirrors, monkeypatch):
+    monkeypatch.setattr(server, "UPSTREAM_TIMEOUT", 5.0)
+    use_mirrors(stand_in("hang"))
+    endpoint = server.ENDPOINTS_BY_NAME["retrieves_detailed_information_about_a_specific_country"]
+    in_flight = server.readiness.in_flight
+
+    async def disconnect_during_call():
+        disconnected = asyncio.Event()
+        context = _context(state={"client_disconnected": disconnected})
+        asyncio.get_running_loop().call_later(0.2, disconnected.set)
+        await server.execute_endpoint(endpoint, context, {"countryCode": "DE"})
+
+    started = time.monotonic()
+    with pytest.raises(server.ToolError) as exc:
+        asyncio.run(disconnect_during_call())
+
+    assert json.loads(str(exc.value))["error_type"] == "cancelled"
+    assert time.monotonic() - started < 1.0
+    assert server.readiness.in_flight == in_flight
+
+
+def test_cancelled_call_makes_no_further_attempts(stand_in, use_mirrors, monkeypatch):
+    monkeypatch.setattr(server, "UPSTREAM_TIMEOUT", 0.5)
+    first, second = stand_in("hang"), stand_in("hang")
+    use_mirrors(first, second)
+
+    async def cancel_during_call():
+        call = asyncio.ensure_future(server._call_upstream(_context(), "/api/v3/AvailableCountries", {}))
+        await asyncio.sleep(0.2)
+        call.cancel()
+        started = time.monotonic()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        return time.monotonic() - started
+
+    assert asyncio.run(cancel_during_call()) < 0.1
+    # The attempt already on the wire runs out its timeout; no failover follows it
+    time.sleep(0.8)
+    assert first.hits + second.hits == 1
@@ -0,0 +1,146 @@
+"""Argument validation and canonicalization, before payment and in the pipeline."""
+import json
+
+import pytest
+
+server = pytest.importorskip("server")
+
+
+@pytest.fixture
+def known_countries(monkeypatch):
+    monkeypatch.setattr(server.readiness.countries, "codes", frozenset({"DE", "US"}))
+
+
+@pytest.mark.parametrize("value, expected", [("de", "DE"), (" us ", "US"), ("GB", "GB")])
+def test_country_code_is_canonicalized(value, expected):
+    assert server.validate_country_code(value) == expected
+
+
+@pytest.mark.parametrize("value", ["DEU", "D", "1A", "", None])
+def test_country_code_format_is_checked(value):
+    with pytest.raises(server.ToolInputError) as exc:
+        server.validate_country_code(value)
+    assert exc.value.field == "countryCode"
+
+
+def test_country_code_is_checked_against_the_warm_cache(known_countries):
+    assert server.validate_country_code("de") == "DE"
+    with pytest.raises(server.ToolInputError, match="not a supported country"):
+        server.validate_country_code("FR")
+
+
+@pytest.mark.parametrize("value, expected", [(None, None), ("", None), ("us-ca", "US-CA"), ("DE-BY", "DE-BY")])
+def test_subdivision_code(value, expected):
+    assert server.validate_subdivision_code(value) == expected
+
+
+def test_subdivision_code_format_is_checked():
+    with pytest.raises(server.ToolInputError):
+        server.validate_subdivision_code("California")
+
+
+@pytest.mark.parametrize("validator, good, bad", [
+    (server.validate_year, ["2024", 1900, 2100, 2026.0], [1899, 2101, "next", 2026.7, float("inf"), float("nan")]),
+    (server.validate_utc_offset, [-12, "0", 12], [-13, 13, "UTC"]),
+    (server.validate_bridge_days, [0, "3"], [-1, None]),
+])
+def test_integer_ranges(validator, good, bad):
+    for value in good:
+        assert validator(value) == int(value)
+    for value in bad:
+        with pytest.raises(server.ToolInputError):
+            validator(value)
+
+
+def test_bool_is_not_an_integer():
+    with pytest.raises(server.ToolInputError, match="expected an integer"):
+        server.validate_year(True)
+
+
+def test_subdivision_must_belong_to_country():
+    check = server.subdivision_in_country("subdivisionCode")
+    check({"countryCode": "US", "subdivisionCode": "US-CA"})
+    check({"countryCode": "US", "subdivisionCode": None})
+    with pytest.raises(server.ToolInputError, match="not a subdivision of US"):
+        check({"countryCode": "US", "subdivisionCode": "DE-BY"})
+
+
+def test_input_error_payload():
+    error = server.ToolInputError("year", "must be between 1900 and 2100")
+
+    assert str(error) == "year: must be between 1900 and 2100"
+    assert error.to_dict("/api/v3/PublicHolidays/{year}/{countryCode}") == {
+        "error": "year: must be between 1900 and 2100",
+        "error_type": "validation_error",
+        "retryable": False,
+        "endpoint": "/api/v3/PublicHolidays/{year}/{countryCode}",
+        "field": "year",
+    }
+
+
+LONG_WEEKENDS = "retrieve_all_long_weekends_for_a_given_country_and_year"
+
+
+def test_endpoint_canonicalizes_arguments():
+    endpoint = server.ENDPOINTS_BY_NAME[LONG_WEEKENDS]
+
+    arguments = endpoint.canonicalize({"year": "2026", "countryCode": "de", "subdivisionCode": "de-by"})
+
+    assert arguments == {"year": 2026, "countryCode": "DE", "availableBridgeDays": 1, "subdivisionCode": "DE-BY"}
+
+
+def test_endpoint_reports_the_argument_that_failed():
+    endpoint = server.ENDPOINTS_BY_NAME[LONG_WEEKENDS]
+    with pytest.raises(server.ToolInputError) as exc:
+        endpoint.canonicalize({"year": 2026, "countryCode": "US", "subdivisionCode": "DE-BY"})
+    assert exc.value.field == "subdivisionCode"
+
+
+def _tools_call(name, arguments):
+    return json.dumps({
+        "jsonrpc": "2.0", "id": 7, "method": "tools/call", "params": {"name": name, "arguments": arguments}
+    }).encode()
+
+
+def test_pre_payment_check_rejects_invalid_arguments():
+    rejection = server.PrePaymentValidationMiddleware._check(_tools_call(LONG_WEEKENDS, {"year": 1800}))
+
+    assert rejection is not None
+    assert rejection["id"] == 7
+    result = rejection["result"]
+    assert result["isError"] is True
+    prefix = f"Error executing tool {LONG_WEEKENDS}: "
+    text = result["content"][0]["text"]
+    assert text.startswith(prefix)
+    error = json.loads(text[len(prefix):])
+    assert (error["error_type"], error["field"]) == ("validation_error", "year")
+
+
+@pytest.mark.parametrize("body", [
+    # Overflows to float("inf") when parsed
+    pytest.param(
+        b'{"jsonrpc": "2.0", "id": 7, "method": "tools/call", "params": {"name": "%s", "arguments": {"year": 1e999}}}'
+        % LONG_WEEKENDS.encode(),
+        id="overflowing-year",
+    ),
+    # int() would truncate this to 2026, which FastMCP rejects after payment
+    pytest.param(_tools_call(LONG_WEEKENDS, {"year": 2026.7, "countryCode": "US"}), id="fractional-year"),
+])
+def test_pre_payment_check_rejects_non_integer_years(body):
+    rejection = server.PrePaymentValidationMiddleware._check(body)
+
+    assert rejection is not None and rejection["result"]["isError"] is True
+    assert "year: expected an integer" in rejection["result"]["content"][0]["text"]
+
+
+@pytest.mark.parametrize("body", [
+    b"not json",
+    pytest.param(json.dumps({"jsonrpc": "2.0", "id": 1, "method": "tools/call", "params": {"name": [1]}}).encode(),
+                 id="list-name"),
+    pytest.param(json.dumps({"jsonrpc": "2.0", "id": 1, "method": "tools/call", "params": {"name": {"a": 1}}}).encode(),
+                 id="dict-name"),
+    json.dumps({"jsonrpc": "2.0", "id": 1, "method": "tools/list"}).encode(),
+    _tools_call("no_such_tool", {"year": "soon"}),
+])
+def test_pre_payment_check_passes_through_what_it_does_not_own(body):
+    assert server.PrePaymentValidationMiddleware._check(body) is None